@@ -24,9 +24,21 @@ LOGGER = get_logger(__name__)
 
 
 # packages needed
-import pandas as pd # loading the datafiles
-from math import radians, sin, cos, atan2, sqrt # advanced math to calculate distance between coordinates
-import openpyxl
+import time
+
+SCRIPT_STARTED = time.perf_counter() # for the time to first paint
+
+from diagnostics import DIAGNOSTICS, EXPORT_PATH, timed # per stage time / rows / memory, see diagnostics.py
+
+# The heavy packages (pandas, numpy, scipy, pydeck, openpyxl, requests) and the modules built on them are
+# imported inside the functions that use them, so the landing page is drawn without loading any of them:
+#   pipeline      raw load -> geo assignment -> coverage matrix, see pipeline.py
+#   coverage      coverage per country / city / hospital
+#   distribution  splitting a stock of doses over the hospitals
+#   maps          server side map aggregation and pydeck layers
+#   patients      Patient class and the registry holding the citizen table
+#   store         SQLite store the registry writes through to, also the source of the dose history
+# Python keeps imported modules, so only the first use pays for the import.
 
 
 # ### Info
@@ -35,296 +47,115 @@ import openpyxl
 # In[21]:
 
 
-# Shortened list of vaccines
-vaccine_abbreviations = [
-    "BCG",  # Bacille Calmette-Guérin
-    "OPV",  # Oral Polio Vaccine
-    "IPV",  # Inactivated Polio Vaccine
-    "DTP",  # Diphtheria, Tetanus, Pertussis
-    "HepB",  # Hepatitis B
-    "MMR",  # Measles, Mumps, Rubella
-    "Rotavirus",
-    "PCV",  # Pneumococcal Conjugate Vaccine
-    "TT",  # Tetanus Toxoid
-    "YFV",  # Yellow Fever Vaccine
-]
-
-# Dictionary mapping abbreviations to full names
-vaccine_dictionary = {
-    "BCG": "Bacille Calmette-Guérin",
-    "OPV": "Oral Polio Vaccine",
-    "DTP": "Diphtheria, Tetanus, Pertussis",
-    "HepB": "Hepatitis B",
-    "MMR": "Measles, Mumps, Rubella",
-    "Rotavirus": "Rotavirus",
-    "PCV": "Pneumococcal Conjugate Vaccine",
-    "IPV": "Inactivated Polio Vaccine",
-    "YFV": "Yellow Fever Vaccine",
-    "TT": "Tetanus Toxoid",
-}
-
-# recommended year range for each vaccine
-vaccine_age_recommendations_years_int = {
-    "BCG": (0, 35),
-    "OPV": (0, 6),
-    "DTP": (0, 2),
-    "HepB": (0, 2),
-    "MMR": (1, 2),
-    "Rotavirus": (0, 1),
-    "PCV": (0, 2),
-    "IPV": (0, 2),
-    "YFV": (1, 10),
-    "TT": (0, 6),
-}
-
-import pandas as pd
-import requests
-from io import BytesIO
-
-# URLs of the Excel files on GitHub (raw file URLs)
-url1 = "https://github.com/marikolk/Vaccination/raw/main/citizens_angola_Bengo.xlsx"
-url2 = "https://github.com/marikolk/Vaccination/raw/main/subset_sub-saharan_health_facilities_edited.xlsx"
-
-# Function to read an Excel file from a URL with specified engine
-def read_excel_from_url(url):
-    response = requests.get(url)
-    file = BytesIO(response.content)
-    return pd.read_excel(file, engine='openpyxl')
-
-
-# Reading the files
-citizens = read_excel_from_url(url1)
-hospitals = read_excel_from_url(url2)
-
-# subsets to work with (the files i sent you guys are already subset, but keep this part of the code to showcase)
-hospitals_subset = hospitals[(hospitals['Country'] == 'Angola') & (hospitals['City'] == 'Bengo')]
-citizens_subset = citizens.head(500)
+# vaccine names, descriptions and recommended age ranges live in vaccines.py (imported where needed)
 
 
 # ## Preparation of data
-# Steps that will only be done basicly
+# Steps that will only be done basicly, each stage is cached so Streamlit reruns (every widget click) skip them
 # 
 # Steps:
-# 1. Function that calculates the distance between two pairs of coordinates
-# 2. A loop that calculates the distances from each citizen to each hospital and store the shortest (stores both the name and the distance in KM)
+# 1. Load the citizen and facility registers (Parquet cache in front of the Excel downloads)
+# 2. Find the nearest hospital of every citizen (stores both the name and the distance in KM)
 # 3. Calculate number of citizens in the belonging to each hospital
 # 4. Calculate the number of citizens that belong to the hospital and is in the right age range for a vaccine, then calculate number vaccinated and not vaccinated
-# 
+# 5. Build the Patient objects for the citizens
+#
+# Stages 1-2 only depend on the source files. The registry (5) is one shared object that is mutated
+# when patients are added or vaccinated and written through to the SQLite store (store.py), which
+# is loaded instead of the registers on later starts; the coverage view (3-4) are built from it once and then
+# adjusted by the registry for every added patient or status update instead of being recomputed.
+# The coverage view keeps the counts per country, city and hospital, the reports only sum over those cells.
+#
+# Every stage is keyed on the version of the last batch run (cli.py, see pipeline.batch_version), so a
+# new batch run is picked up by the running app: the stages are recomputed and the new assignment is
+# merged into the store (vaccinations given in the app are kept, see store.Store.merge_citizens).
+# Without batch runs, registers whose content changed (see data_cache.py) are merged the same way on
+# the next start.
 
 # In[28]:
 
 
-# calculate distance between two pairs of coordinates
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371  # Radius of the Earth in kilometers
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
-    a = (sin(dlat / 2) ** 2) + cos(radians(lat1)) * cos(radians(lat2)) * (sin(dlon / 2) ** 2)
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
-    distance = R * c
-    return distance
-
-# Loop through citizens and find the nearest hospital, (Nearest_Hospital and Distance_to_Nearest_Hospital)
-for index_citizen, citizen in citizens_subset.iterrows():
-    distances = {}
-
-    # Calculate distances for all hospitals for the current citizen
-    for index_hospital, hospital in hospitals_subset.iterrows():
-        distance = haversine(citizen['Lat'], citizen['Long'], hospital['Lat'], hospital['Long'])
-        distances[hospital['Facility Name']] = distance
-
-    # Find the nearest hospital for the current citizen
-    min_distance_hospital = min(distances, key=distances.get)
-    min_distance_value = distances[min_distance_hospital]
-
-    # Assign the nearest hospital and distance to the citizens_subset DataFrame
-    citizens_subset.at[index_citizen, 'Nearest_Hospital'] = min_distance_hospital
-    citizens_subset.at[index_citizen, 'Distance_to_Nearest_Hospital'] = min_distance_value
-
-# Count Citizens belonging to each hospital
-hospitals_subset['Citizens'] = hospitals_subset['Facility Name'].apply(lambda hospital_name: citizens_subset['Nearest_Hospital'].eq(hospital_name).sum()
-)
-
-# count number of citizens in the relevant age range for each vaccine, then count number of vaccinated and not vaccinated
-for vaccine, age_range in vaccine_age_recommendations_years_int.items():
-    # Filter individuals within the age range for the vaccine
-    eligible_individuals = citizens_subset[
-        (citizens_subset['Age'] >= age_range[0]) & (citizens_subset['Age'] <= age_range[1])
-    ]
-
-    for index, hospital in hospitals_subset.iterrows():
-        # Count total relevant population for the hospital
-        vaccine_hospital_tot_count = len(eligible_individuals[eligible_individuals['Nearest_Hospital'] == hospital['Facility Name']])
-
-        # Count the number of citizens who have taken the vaccine
-        vaccinated_count = eligible_individuals[(eligible_individuals['Nearest_Hospital'] == hospital['Facility Name']) & (eligible_individuals[vaccine] == 1)].shape[0]
-
-        # Count the number of citizens who have not taken the vaccine
-        not_vaccinated_count = vaccine_hospital_tot_count - vaccinated_count
-
-        # Add new columns to hospitals_subset for the current vaccine
-        hospitals_subset.loc[index, f'{vaccine}_Citizen_Count'] = vaccine_hospital_tot_count
-        hospitals_subset.loc[index, f'{vaccine}_Vaccinated_Count'] = vaccinated_count
-        hospitals_subset.loc[index, f'{vaccine}_Not_Vaccinated_Count'] = not_vaccinated_count
-
-
-# In[26]:
-
-
-# here is how the df look now
-
-# first lets check the Hospitals here we now have citizens in the rigth age range and if their vaccinated
-
-bcg_columns = hospitals_subset.filter(like='BCG')
-selected_columns = ['Country', 'City', 'Facility Name'] + list(bcg_columns.columns)
-subset_with_bcg_columns = hospitals_subset[selected_columns]
-
-
-
-# Above we see how many citizens that belongs to a hospital in the rigth age range, and also how many are vaccinated and not. The BCG vaccine with zeros is used to input how many vaccines the hospitals has and is currenly 0
-
-
-
-
-# Now we can see that individuals have been assigned to their nearest hospital and the distance in KM is also listed
-
-# ## Class Patient
-# 
-# Making a class that enables a few different functions
-# 
-# * You can inout data frames that that then is converted to a the class so that all the class functions can be used on the data frame
-# * You can also add patient, update vaccine status -> this will modify the original and global DF
-# * Functions like, summary etc to get vaccination status and patient info
-
-# In[29]:
-
-
-# ask for the hospital of the worker
-my_hospital = 'Hospital Provincial de Bengo'
-patients_subset = []
-# making a class, the class can also convert df with patients/citizens
-class Patient:
-  all_IDs = []
-  all_countries = []
-  all_cities = []
-
-  # Possible vaccines
-  possible_vaccines = [v.upper() for v in vaccine_abbreviations]
-
-  # Vaccine dictionary
-  vaccine_description = vaccine_dictionary
-
-  # default input
-  def __init__(self, ID, age, gender, hospital=my_hospital, df=None):
-    self.ID = ID
-    self.age = age
-    self.gender = gender
-    self.hospital = hospital
-    self.vaccine_status = {}
-    Patient.all_IDs.append(ID)
-
-    # Access DataFrame to get additional information (to have less input work from health worker)
-    if df is None:
-      hospital_info = hospitals_subset[hospitals_subset['Facility Name'] == hospital].iloc[0]
-      self.city = hospital_info['City']
-      self.country = hospital_info['Country']
-      Patient.all_countries.append(hospital_info['Country'])
-      Patient.all_cities.append(hospital_info['City'])
-      self.add_to_citizens_subset()
+# @timed sits under the cache decorators, so only runs that really compute a stage are recorded
+@st.cache_data(show_spinner="Loading the citizen and facility registers...", max_entries=1)
+@timed('load_registers', rows=lambda registers: len(registers[0]))
+def load_registers(version):
+    import pipeline
+    # outputs of the last batch run (cli.py) if there are any, the citizens are already assigned then;
+    # version is only the cache key
+    batch = pipeline.load_batch()
+    if batch is not None:
+        return batch
+    return pipeline.load_registers()
+
+
+@st.cache_resource(max_entries=1)
+@timed('facility_index', rows=len)
+def facility_index(version):
+    import pipeline
+    _, hospitals_subset = load_registers(version)
+    return pipeline.build_facility_index(hospitals_subset)
+
+
+@st.cache_data(show_spinner="Assigning citizens to their nearest hospital...", max_entries=1)
+@timed('geo_assignment', rows=len)
+def geo_assignment(version):
+    import pipeline
+    citizens_subset, hospitals_subset = load_registers(version)
+    if 'Nearest_Hospital' in citizens_subset:
+        return citizens_subset
+    return pipeline.geo_assignment(citizens_subset, hospitals_subset, index=facility_index(version))
+
+
+@st.cache_resource(show_spinner="Building the patient registry...", max_entries=1)
+@timed('patient_registry', rows=len)
+def patient_registry(version):
+    import pipeline
+    from patients import PatientRegistry
+    from store import Store
+    # the store keeps registrations and vaccinations across restarts; it is filled from the registers on first start
+    # and merged with them whenever they change: a newer batch run, or else new content of the source registers
+    _, hospitals_subset = load_registers(version)
+    source = f'batch {version}' if version is not None else f'registers {pipeline.registers_version()}'
+    store = Store()
+    if not len(store):
+        citizens = geo_assignment(version)
+        store.save_facilities(hospitals_subset)
+        store.add_citizens(citizens)
+        store.set_meta('source_version', source)
     else:
-      patient_info = df[df['ID'] == ID].iloc[0]
-      self.city = patient_info['City']
-      self.country = patient_info['Country']
-      Patient.all_countries.append(patient_info['Country'])
-      Patient.all_cities.append(patient_info['City'])
-
-    # Set vaccination status based on DataFrame information
-      self.set_vaccination_status_from_df(patient_info)
-
-    patients_subset.append(self)
-
-  def add_to_citizens_subset(self):
-    global citizens_subset
-    new_patient_info = {'ID': self.ID, 'Age': self.age, 'Gender': self.gender, 'City': self.city, 'Country': self.country}
-    citizens_subset = citizens_subset.append(new_patient_info, ignore_index=True)
-
-  def set_vaccination_status_from_df(self, patient_info):
-    # Extract relevant columns from DataFrame
-    vaccine_columns = patient_info.index[patient_info.index.isin(vaccine_abbreviations)]
-
-    # Set vaccination status based on DataFrame information
-    for vaccine in vaccine_columns:
-      self.vaccine_status[vaccine.upper()] = bool(patient_info[vaccine])
-
-
-  def get_vaccines_list(self):
-    return self.vaccine_description
-
-  def input_vaccination_status(self, **kwargs):
-    expected_vaccines = {vaccine.upper() for vaccine in self.get_not_true_vaccines()}
-
-    for vaccine_name, status in kwargs.items():
-      if vaccine_name.upper() in expected_vaccines:
-        self.vaccine_status[vaccine_name.upper()] = status
-      else:
-        print(f"Ignoring unknown vaccine: {vaccine_name}")
+        if store.meta('source_version') != source:
+            store.save_facilities(hospitals_subset)
+            store.merge_citizens(geo_assignment(version))
+            store.set_meta('source_version', source)
+        citizens = store.load_citizens()
+    return PatientRegistry(citizens, hospitals_subset, index=facility_index(version), store=store)
 
-    # Update vaccination status in citizens_subset
-      self.update_citizens_subset_vaccination_status()
 
-  def update_citizens_subset_vaccination_status(self):
-    global citizens_subset
-    # Find the patient in citizens_subset and update their vaccination status
-    row_index = citizens_subset.loc[citizens_subset['ID'] == self.ID].index[0]
-    for vaccine, status in self.vaccine_status.items():
-      citizens_subset.at[row_index, vaccine] = int(status)
+@st.cache_resource(show_spinner="Calculating vaccine coverage...", max_entries=1)
+@timed('coverage_view', rows=lambda view: len(view.cells))
+def build_coverage_view(version):
+    from coverage import CoverageView
+    return CoverageView.from_registry(patient_registry(version), subscribe=True)
 
 
-    # get the vaccines the child has taken
-  def get_true_vaccines(self):
-    true_keys = []
-    for key, value in self.vaccine_status.items():
-      if value == True:
-        true_keys.append(key)
-    return true_keys
+# Nothing is loaded when the script starts: the stages run the first time a menu needs them
+# (with a spinner), later reruns get them from the Streamlit caches as long as no new batch run appeared.
+def data_version():
+    import pipeline
+    return pipeline.batch_version()
 
-  # get the vaccines the child misses
-  def get_not_true_vaccines(self):
-    missing_vaccines = []
-    for vaccine in self.possible_vaccines:
-      if vaccine not in self.get_true_vaccines():
-        missing_vaccines.append(vaccine)
-      else: pass
-    return missing_vaccines
 
-  def summary(self):
-    print(f'Patient with ID {self.ID} has birth gender {self.gender}. This patient has age {self.age} and lives in {self.city}.\nThe patient has at current time taken these vaccines: {self.get_true_vaccines()}\nVaccines that are missing: {self.get_not_true_vaccines()}')
+def app_registry():
+    return patient_registry(data_version())
 
 
-# In[30]:
-
-
-# adding the df to the class
-patients_subset = [Patient(ID=row['ID'], age=row['Age'], gender=row['Gender'], df=citizens_subset) for _, row in citizens_subset.iterrows()]
-
-
-# In[31]:
+def coverage_view():
+    return build_coverage_view(data_version())
 
 
 # Function to find a patient by ID
-def find_patient_by_id(target_id:int, patients_list=patients_subset):
-    for patient in patients_list:
-        if patient.ID == target_id:
-            return patient  # Return the patient instance if found
-    return None  # Return None if no patient with the specified ID is found
-
-
-# In[32]:
-
-
-# okey lets check if the patient from the data frame we loaded is of the class Patients
-cool_human =  find_patient_by_id(2)
-cool_human.summary()
+def find_patient_by_id(target_id:int):
+    return app_registry().find(target_id)
 
 
 
@@ -364,15 +195,16 @@ cool_human.summary()
 # In[ ]:
 
 
-import streamlit as st
-
 # Define global variables or import necessary modules here
 
 # Function to display the initial interface
+@timed()
 def main():
     st.header("Welcome to the AngoVaxTracker :flag-ao:", divider='rainbow')
     st.write("Please specify if you work at a hospital or for the government.")
     choice = st.selectbox("Select your workplace:", (' ','Hospital', 'Government'))
+    # the landing page is complete here, everything below only runs for the chosen menu
+    DIAGNOSTICS.record('first_paint', time.perf_counter() - SCRIPT_STARTED)
 
     if choice == 'Hospital':
         st.header("AngoVaxTracker :flag-ao: for Hospitals")
@@ -384,10 +216,11 @@ def main():
        
         
 # Function to display the hospital menu
+@timed()
 def hospital_menu():
     st.subheader("AngoVaxTracker for Hospitals")
     choice = st.radio("What would you like to do?", 
-                      ('Get a report on a patient', 'Add a patient', 'Update vaccine status'))
+                      ('Get a report on a patient', 'Add a patient', 'Update vaccine status', 'Find patients missing a vaccine'))
 
     if choice == 'Get a report on a patient':
         get_report()
@@ -395,62 +228,96 @@ def hospital_menu():
         add_new_patient()
     elif choice == 'Update vaccine status':
         update_vaccine_status()
+    elif choice == 'Find patients missing a vaccine':
+        missing_vaccine_report()
 
 # Function for adding a new patient
+@timed()
 def add_new_patient():
-  print('I can help you with that, please provide me with ID, age and gender of the patient and the hospital you are currently at.')
-  ID_exists = True
+    from patients import Patient, my_hospital
+    registry = app_registry()
+    st.write('I can help you with that, please provide me with ID, age and gender of the patient and the hospital you are currently at.')
+    ID_input = st.number_input('ID:', min_value=0, step=1)
 
-  while ID_exists == True:
-    ID_input = st.number_input('ID:', step=1)
+    #If the ID is already in the registry, then we cannot add another patient with this ID (dict lookup, no scan).
+    if ID_input in registry:
+        st.warning("This ID is already registered. Please provide another ID.")
+        return
 
-    #If the ID is already in our Patient class, then we cannot add another patient with this ID.
-    if ID_input in Patient.all_IDs:
-      st.warning("This ID is already registered. Please provide another ID.")
-    else:
-        ID_exists = False
-        age_input = st.number_input('Age in whole number:', step=1)
-        gender_input = st.selectbox('Select Gender:', ['F', 'M']).upper()
-        hospital_input = st.text_input('The Hospital Facility Name:')
-        patient_at_hand = Patient(ID=ID_input, age=age_input, gender=gender_input, hospital=hospital_input)
-
-        # Also add vaccines for the new patient?
-    st.write('Thank you. Would you also like to update the vaccine status of the patient you added?')
-    update_vaccines = st.radio("Select an option:", ["Yes", "No"]).upper()
-
-    if update_vaccines == 'YES':
-        set_vaccine_status(patient_at_hand)
-    # If No, we pass
-    else:
-        pass
+    age_input = st.number_input('Age in whole number:', min_value=0, step=1)
+    gender_input = st.selectbox('Select Gender:', ['F', 'M']).upper()
+    hospital_names = registry.hospitals['Facility Name'].tolist()
+    hospital_input = st.selectbox('The Hospital Facility Name:', hospital_names,
+                                  index=hospital_names.index(my_hospital) if my_hospital in hospital_names else 0)
+
+    # Also add vaccines for the new patient?
+    st.write('Would you also like to register vaccines the patient has already taken?')
+    vaccines_taken = st.multiselect('Vaccines taken:', Patient.possible_vaccines)
+
+    if st.button('Add Patient'):
+        patient_at_hand = Patient(ID=ID_input, age=age_input, gender=gender_input, hospital=hospital_input, registry=registry)
+        if vaccines_taken:
+            patient_at_hand.input_vaccination_status(**{vaccine: True for vaccine in vaccines_taken})
+        st.success(f"Patient with ID {ID_input} added to {hospital_input}.")
 
 
 # Function for updating vaccine status
+@timed()
 def update_vaccine_status():
+    from vaccines import vaccine_abbreviations, vaccine_dictionary
+    # full vaccine names by the upper case keys the Patient class uses
+    vaccine_names = {v.upper(): vaccine_dictionary[v] for v in vaccine_abbreviations}
     st.subheader("Update Vaccine Status")
-    patient_id = st.number_input("Enter the patient ID to update vaccine status:", step=1)
-    # Implement logic to find patient and update status
+    patient_id = st.number_input("Enter the patient ID to update vaccine status:", min_value=0, step=1)
+    patient = find_patient_by_id(patient_id)
+
+    if patient is None:
+        st.error("Patient not found. Please try again.")
+        return
+
+    vaccines_taken = st.multiselect("Vaccines taken:", patient.get_not_true_vaccines(),
+                                    format_func=lambda vaccine: f"{vaccine} ({vaccine_names[vaccine]})")
     if st.button("Update Status"):
+        patient.input_vaccination_status(**{vaccine: True for vaccine in vaccines_taken})
         st.success(f"Vaccine status updated for patient ID: {patient_id}")
 
 # Function for getting a report
+@timed()
 def get_report():
     st.subheader("Get a Report on a Patient")
     patient_id = st.number_input("Enter the patient ID:", min_value=0, step=1)
     find_button = st.button("Find Patient")
 
     if find_button:
-        # Assuming 'find_patient_by_id' is a function that returns patient data or None
-        patient_data = patient_id # Implement this function according to your data structure
+        patient_data = find_patient_by_id(patient_id)
 
         if patient_data:
-            st.write(f'Patient with ID {patient_id} has birth gender M. This patient is 26 years old and lives in Bengo.\nThe patient has at current time taken these vaccines: HPV, OPV. \nVaccines that are missing: Rotavirus')
-            patient_id = None
+            st.write(patient_data.report())
         else:
             st.error("Patient not found. Please try again.")
 
+# Function for listing the patients of a hospital that are due for a vaccine
+@timed()
+def missing_vaccine_report():
+    from patients import my_hospital
+    from vaccines import vaccine_abbreviations
+    registry = app_registry()
+    st.subheader("Patients Missing a Vaccine")
+    hospital_names = registry.hospitals['Facility Name'].tolist()
+    hospital = st.selectbox('Hospital:', hospital_names,
+                            index=hospital_names.index(my_hospital) if my_hospital in hospital_names else 0)
+    vaccines = st.multiselect('Missing any of these vaccines:', vaccine_abbreviations, default=vaccine_abbreviations[:1])
+    eligible_only = st.checkbox('Only patients in the recommended age range', value=True)
+
+    if vaccines:
+        # bitmask query over the whole registry, no loop over patients
+        rows = registry.missing_rows(vaccines, hospital=hospital, eligible_only=eligible_only)
+        st.write(f"{len(rows)} patients at {hospital} are missing at least one of: {', '.join(vaccines)}.")
+        st.dataframe(registry.citizens.iloc[rows][['ID', 'Age', 'Gender'] + vaccines], hide_index=True)
+
         
 # Function to display the government menu
+@timed()
 def government_menu():
     st.subheader("AngoVaxTracker for Government")
     choice = st.radio("What would you like to do?", 
@@ -467,50 +334,95 @@ def government_menu():
     elif choice == 'Show unvaccinated population':
         unvaccinated_map()
 
-# Example function for adding citizens (you'll need to implement the logic)
+# Function for adding citizens in bulk from a CSV or Excel file
+@timed()
 def add_citizens():
-    st.write("You chose the option 'Add citizens'")
-    # Implement the logic for adding citizens
+    st.subheader("Add Citizens")
+    st.write("Upload a CSV or Excel file with at least the columns ID and Age. "
+             "Citizens with Lat/Long are assigned to their nearest hospital, vaccine columns (0/1) are optional.")
+    upload = st.file_uploader("Citizen file", type=['csv', 'xlsx'])
+
+    if upload is not None and st.button("Import citizens"):
+        import pandas as pd
+        registry = app_registry()
+        new_citizens = pd.read_csv(upload) if upload.name.endswith('.csv') else pd.read_excel(upload, engine='openpyxl')
+        missing_columns = {'ID', 'Age'} - set(new_citizens.columns)
+        if missing_columns or ('Nearest_Hospital' not in new_citizens and not {'Lat', 'Long'} <= set(new_citizens.columns)):
+            st.error("The file needs the columns ID, Age and either Lat/Long or Nearest_Hospital.")
+            return
+
+        # one batched append for the whole file
+        skipped = registry.add_citizens(new_citizens)
+        st.success(f"Added {len(new_citizens) - len(skipped)} citizens.")
+        if skipped:
+            st.warning(f"{len(skipped)} rows were skipped because their ID is already registered: {skipped[:20]}")
+        if 'Nearest_Hospital' not in new_citizens:
+            from geo import located
+            unlocated = new_citizens.loc[~located(pd.to_numeric(new_citizens['Lat'], errors='coerce'),
+                                                  pd.to_numeric(new_citizens['Long'], errors='coerce')), 'ID']
+            if len(unlocated):
+                st.warning(f"{len(unlocated)} citizens have no valid Lat/Long and were not assigned to a hospital: "
+                           f"{unlocated.tolist()[:20]}")
 
 # Example function for distributing vaccines (you'll need to implement the logic)
+@timed()
 def distribute_vaccines():
-    st.write("You chose the option 'Distribute vaccines'")
-    # Implement the logic for distributing vaccines
+    import pandas as pd
+    from distribution import distribute, distance_weights, distribution_summary
+    from vaccines import vaccine_abbreviations, vaccine_bits
+    st.subheader("Distribute vaccines")
+    registry = app_registry()
+    coverage = coverage_view().hospital_frame()
+    if coverage.empty:
+        st.info("No citizens registered yet.")
+        return
+
+    mode = st.radio("Distribute to", ('Lowest coverage first', 'Citizens living far from their hospital first'))
+    st.write("National stock per vaccine (doses):")
+    stock = pd.DataFrame({'Doses': [int(coverage[f'{v}_Not_Vaccinated_Count'].sum()) // 2 for v in vaccine_abbreviations]},
+                         index=pd.Index(vaccine_abbreviations, name='Vaccine'))
+    stock = st.data_editor(stock)
+    if not st.button("Distribute"):
+        return
+
+    stock = {vaccine: max(int(doses), 0) for vaccine, doses in stock['Doses'].items()}
+    if mode == 'Lowest coverage first':
+        doses = distribute(coverage, stock, mode='coverage')
+    else:
+        weights = distance_weights(registry.citizens, registry.eligible, registry.status, vaccine_bits)
+        doses = distribute(coverage, stock, mode='distance', weights=weights)
 
-# Example function for getting the overall report (you'll need to implement the logic)
-import streamlit as st
+    st.write("Summary:")
+    st.table(distribution_summary(coverage, doses))
+    st.write("Doses per hospital:")
+    st.dataframe(doses[doses.sum(axis=1) > 0])
 
+# Example function for getting the overall report (you'll need to implement the logic)
+@timed()
 def country_report():
+    from vaccines import vaccine_abbreviations, vaccine_dictionary
+    registry = app_registry()
+    view = coverage_view()
+
     # Display the country
-    country_input = st.selectbox(label="Choose country", options=["Angola"])
-    
-   
+    countries = view.values('Country')
+    if not countries:
+        st.info("No citizens registered yet.")
+        return
+    country_input = st.selectbox(label="Choose country", options=countries,
+                                 index=countries.index('Angola') if 'Angola' in countries else 0)
+
     st.subheader(f"Country Report for {country_input}")    
     
-    # Calculate hospitals and cities counts
-    list_hospitals = hospitals_subset[hospitals_subset['Country'] == country_input]['Facility Name'].tolist()
+    # Calculate hospitals and cities counts (from the materialized view, no scan of the citizens)
+    list_hospitals = registry.hospitals[registry.hospitals['Country'] == country_input]['Facility Name'].tolist()
     hospitals_count = len(list_hospitals)
-    full_list_cities = citizens_subset[citizens_subset['Country'] == country_input]['City'].tolist()
-    list_cities = list(dict.fromkeys(full_list_cities))
+    list_cities = view.values('City', Country=country_input)
     cities_count = len(list_cities)
 
-    # Prepare to display vaccine coverage
-    full_list_IDs = []
-    vaccine_coverage_data = []
-
-    for vaccine, age_range in vaccine_age_recommendations_years_int.items():
-        eligible_individuals = citizens_subset[(citizens_subset['Age'] >= age_range[0]) & (citizens_subset['Age'] <= age_range[1]) & (citizens_subset['Country'] == country_input)]
-        list_elig = eligible_individuals['ID'].tolist()
-        elig_count = len(list_elig)
-        elig_vaccinated = eligible_individuals[vaccine].sum()
-        coverage_rate = round(elig_vaccinated / elig_count, 4) if elig_count else 0
-        vaccine_coverage_data.append([vaccine, elig_vaccinated, elig_count, coverage_rate])
-        full_list_IDs.extend(list_elig)
-
-    list_IDs = list(dict.fromkeys(full_list_IDs))
-    patients_count = len(list_IDs)
-
-    vaccine_coverage_df = pd.DataFrame(vaccine_coverage_data, columns=['Vaccine', 'Eligible & Vaccinated', 'Eligible Total', 'Coverage Rate'])
+    # vaccine coverage and the number of patients eligible for at least one vaccine
+    vaccine_coverage_df = view.vaccine_table(Country=country_input)
+    patients_count = int(view.rollup('Country', Country=country_input)['Eligible_Any'].sum())
     
     # Display summary information
     st.write(f"{country_input} has {cities_count} cities and {hospitals_count} hospitals.")
@@ -518,7 +430,13 @@ def country_report():
     
     # Display vaccine coverage table
     st.write("Vaccine Coverage:")
-    st.table(vaccine_coverage_df.set_index('Vaccine'))
+    st.table(vaccine_coverage_df)
+
+    # history from the vaccination events the store records with every status update
+    doses = registry.store.doses_over_time('W')
+    if not doses.empty:
+        st.write("Doses recorded in the app (cumulative per week):")
+        st.line_chart(doses)
 
     # Interactive part for more detailed report
     detailed_report = st.radio("Do you want to get a more detailed report?", 
@@ -527,61 +445,150 @@ def country_report():
     if detailed_report == 'Specify a city':
         city = st.selectbox("Choose a city", list_cities)
         if city:
-            city_report(city, country_input)  # Define this function
+            city_report(city, country_input)
 
     elif detailed_report == 'Specify a vaccine':
-        vaccine = st.selectbox("Choose a vaccine", list(vaccine_abbreviations.keys()))
+        vaccine = st.selectbox("Choose a vaccine", vaccine_abbreviations,
+                               format_func=lambda vaccine: f"{vaccine} ({vaccine_dictionary[vaccine]})")
         if vaccine:
-            vaccine_report(vaccine, country_input)  # Define this function
+            vaccine_report(vaccine, country_input)
 
     elif detailed_report == 'Specify a hospital':
         hospital = st.selectbox("Choose a hospital", list_hospitals)
         if hospital:
-            hospital_report(hospital)  # Define this function
+            hospital_report(hospital)
+
+
+# Drill-down reports, each one is a slice of the coverage view (no scan of the citizens)
+@timed()
+def city_report(city, country):
+    view = coverage_view()
+    st.subheader(f"City Report for {city}")
+    totals = view.rollup('City', Country=country, City=city)
+    st.write(f"{city} has {int(totals['Citizens'].sum())} registered citizens, "
+             f"{int(totals['Eligible_Any'].sum())} of them are eligible for at least one vaccine.")
+    st.write("Vaccine Coverage:")
+    st.table(view.vaccine_table(Country=country, City=city))
+
+    # the hospitals the citizens of this city belong to
+    hospitals = view.rollup('Nearest_Hospital', Country=country, City=city)[['Citizens', 'Eligible_Any']]
+    st.write("Hospitals:")
+    st.dataframe(hospitals.rename(columns={'Eligible_Any': 'Eligible for a vaccine'}))
+
+
+@timed()
+def vaccine_report(vaccine, country):
+    from vaccines import vaccine_dictionary, vaccine_age_recommendations_years_int
+    view = coverage_view()
+    st.subheader(f"Vaccine Report for {vaccine} ({vaccine_dictionary[vaccine]}) in {country}")
+    low, high = vaccine_age_recommendations_years_int[vaccine]
+    st.write(f"Recommended age: {low} to {high} years. Lowest coverage first.")
+    st.write("Per city:")
+    st.table(view.breakdown(vaccine, 'City', Country=country))
+    st.write("Per hospital:")
+    st.dataframe(view.breakdown(vaccine, 'Nearest_Hospital', Country=country))
+
+
+@timed()
+def hospital_report(hospital):
+    view = coverage_view()
+    st.subheader(f"Hospital Report for {hospital}")
+    totals = view.rollup('Nearest_Hospital', Nearest_Hospital=hospital)
+    st.write(f"{int(totals['Citizens'].sum())} citizens belong to {hospital}, "
+             f"{int(totals['Eligible_Any'].sum())} of them are eligible for at least one vaccine.")
+    st.write("Vaccine Coverage:")
+    st.table(view.vaccine_table(Nearest_Hospital=hospital))
 
             
 #### fancy hospital map function #####
-import streamlit as st
-import pandas as pd
-import numpy as np
-
+@timed()
 def hospital_map():
-    df = pd.DataFrame({
-        "col1": [-8.6560,-8.5025,-7.8522,-8.6742,-8.5835,-8.1328,-8.7131,-8.4995,-8.5824],
-        "col2": [13.4918,14.5862,13.1306,14.7925,13.6569,14.2947,14.4626,14.5866,13.6594],
-    })
-
-    st.map(df,
-        latitude='col1',
-        longitude='col2',
-        size = 1000
-        )    
-
+    import pydeck as pdk
+    from coverage import join_coverage
+    from maps import facility_points, bounding_box, view_state, map_points, facility_layer
+    from vaccines import vaccine_abbreviations
+    registry = app_registry()
+    points = facility_points(join_coverage(registry.hospitals, coverage_view().hospital_frame()), vaccine_abbreviations)
+    if points.empty:
+        st.write("There are no facilities with known coordinates.")
+        return
+
+    # only the facilities of the chosen area are sent to the map, clustered when zoomed out
+    areas = ['All facilities'] + sorted(registry.hospitals['City'].dropna().unique())
+    area = st.selectbox("Show the facilities of", areas)
+    shown = points if area == 'All facilities' else points[points['City'] == area]
+    if shown.empty:
+        st.write(f"There are no facilities with known coordinates in {area}.")
+        return
+    box = bounding_box(shown['Lat'], shown['Long'])
+    state = view_state([box[0], box[2]], [box[1], box[3]], pitch=0)
+    zoom = st.slider("Zoom", min_value=1, max_value=15, value=int(round(state.zoom)))
+    state.zoom = zoom
+    drawn = map_points(shown, box, zoom)
+
+    st.write(f"{len(shown)} facilities, drawn as {len(drawn)} markers. Marker size: assigned citizens, "
+             f"colour: coverage rate over all vaccines.")
+    st.pydeck_chart(pdk.Deck(
+        layers=[facility_layer(drawn)],
+        initial_view_state=state,
+        tooltip={"text": "{Facility Name}\nCitizens: {Citizens}\nEligible & Vaccinated: {Vaccinated} of {Eligible}\n"
+                         "Coverage rate: {Coverage Rate}"},
+    ))
+
+@timed()
 def unvaccinated_map():
-    vaccine_choice = st.selectbox(label="Please select the vaccine.", options=['BCG', 'OPV', 'DTP', 'HepB', 'MMR', 'Rotavirus', 'PCV', 'IPV', 'YFV', 'TT'])
-    map_button = st.button("View map")
-    
-    
-    if map_button:
-        unvaccinated_lat = citizens_subset[citizens_subset[vaccine_choice] == 0]['Lat'].tolist()
-        unvaccinated_long = citizens_subset[citizens_subset[vaccine_choice] == 0]['Long'].tolist()
-    
-    df = pd.DataFrame({
-        "col1": unvaccinated_lat,
-        "col2": unvaccinated_long,
-    })
-
-    st.map(df,
-        latitude='col1',
-        longitude='col2',
-        size = 100
-        ) 
- 
-    
+    import pydeck as pdk
+    from maps import hex_coverage, hex_column_layer, view_state
+    from vaccines import vaccine_abbreviations, vaccine_bits
+    vaccine_choice = st.selectbox(label="Please select the vaccine.", options=vaccine_abbreviations)
+    size_km = st.slider("Cell size (km)", min_value=1, max_value=50, value=5)
+
+    # eligible citizens without the vaccine, counted per hexagon on the server; only the cells go to the browser
+    bit = vaccine_bits[vaccine_choice]
+    registry = app_registry()
+    eligible = (registry.eligible & bit) != 0
+    vaccinated = (registry.status & bit) != 0
+    cells = hex_coverage(registry.citizens['Lat'], registry.citizens['Long'], eligible, vaccinated, size_km=size_km)
+    if cells.empty:
+        st.write(f"No citizens with known coordinates are eligible for {vaccine_choice}.")
+        return
+
+    st.write(f"{int(cells['Unvaccinated'].sum())} of {int(cells['Eligible'].sum())} eligible citizens are not "
+             f"vaccinated against {vaccine_choice}. Column height: unvaccinated citizens, colour: coverage rate.")
+    st.pydeck_chart(pdk.Deck(
+        layers=[hex_column_layer(cells, size_km)],
+        initial_view_state=view_state(cells['Lat'], cells['Long']),
+        tooltip={"text": "Eligible: {Eligible}\nVaccinated: {Vaccinated}\nUnvaccinated: {Unvaccinated}\n"
+                         "Coverage rate: {Coverage Rate}"},
+    ))
+
+
+# Sidebar panel with the time, rows and memory of the stages and menu handlers run so far
+def diagnostics_panel():
+    if EXPORT_PATH:
+        DIAGNOSTICS.export(EXPORT_PATH)
+    # the tables need pandas, so they are only drawn on request
+    if not st.sidebar.checkbox("Show diagnostics"):
+        return
+    with st.sidebar.expander("Diagnostics", expanded=True):
+        summary = DIAGNOSTICS.summary()
+        if summary.empty:
+            st.write("No stages recorded yet.")
+            return
+        st.write("Per stage, slowest first (memory: change in resident memory):")
+        st.dataframe(summary)
+        st.write("Last runs:")
+        st.dataframe(DIAGNOSTICS.to_list()[::-1][:50], hide_index=True)
+        st.download_button("Export as JSON", DIAGNOSTICS.to_json(), file_name='angovax-diagnostics.json',
+                           mime='application/json')
+        if st.button("Clear diagnostics"):
+            DIAGNOSTICS.clear()
+
 
 # Main function to run the Streamlit app
 if __name__ == "__main__":
     main() 
+    diagnostics_panel()
 
     
 
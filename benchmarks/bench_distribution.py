@@ -0,0 +1,67 @@
+# Benchmark: vaccine distribution
+#
+# Times distribution.distribute() in both modes on synthetic hospital coverage
+# tables, and checks that every allocation uses the stock without exceeding any
+# hospital's need.
+#
+#   python benchmarks/bench_distribution.py --hospitals 1000 5000 20000 --stock-share 0.3
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from coverage import coverage_columns  # noqa: E402
+from distribution import MODES, distribute  # noqa: E402
+from vaccines import vaccine_abbreviations  # noqa: E402
+
+
+def make_coverage(n, rng):
+    coverage = pd.DataFrame(index=pd.Index([f'Hospital {i}' for i in range(n)], name='Nearest_Hospital'))
+    coverage['Citizens'] = rng.integers(100, 20_000, n)
+    for vaccine in vaccine_abbreviations:
+        eligible = (coverage['Citizens'] * rng.uniform(0.05, 0.6, n)).astype(np.int64)
+        vaccinated = (eligible * rng.uniform(0, 1, n)).astype(np.int64)
+        coverage[f'{vaccine}_Citizen_Count'] = eligible
+        coverage[f'{vaccine}_Vaccinated_Count'] = vaccinated
+        coverage[f'{vaccine}_Not_Vaccinated_Count'] = eligible - vaccinated
+    return coverage[coverage_columns(vaccine_abbreviations)]
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the vaccine distribution.')
+    parser.add_argument('--hospitals', type=int, nargs='+', default=[1_000, 5_000, 20_000])
+    parser.add_argument('--stock-share', type=float, default=0.3,
+                        help='national stock per vaccine as a share of its unvaccinated eligible citizens')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'hospitals':>10} {'mode':>10} {'seconds':>10}")
+    for n in args.hospitals:
+        coverage = make_coverage(n, rng)
+        stock = {vaccine: int(coverage[f'{vaccine}_Not_Vaccinated_Count'].sum() * args.stock_share)
+                 for vaccine in vaccine_abbreviations}
+        weights = pd.DataFrame(rng.uniform(0, 50, (n, len(vaccine_abbreviations))), index=coverage.index,
+                               columns=vaccine_abbreviations)
+        for mode in MODES:
+            doses, seconds = timed(distribute, coverage, stock, mode=mode, weights=weights)
+            print(f"{n:>10} {mode:>10} {seconds:>10.3f}")
+            for vaccine, available in stock.items():
+                assert doses[vaccine].sum() == available
+                assert (doses[vaccine] <= coverage[f'{vaccine}_Not_Vaccinated_Count']).all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# Benchmark: nearest-hospital assignment
+#
+# Compares the old iterrows() loop from Hello.py with the vectorized, chunked
+# engine in geo.py on synthetic registers (synthetic.py).
+#
+#   python benchmarks/bench_nearest_hospital.py --sizes 500 100000 1000000 --hospitals 40
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from geo import haversine, assign_nearest_hospital  # noqa: E402
+from synthetic import make_citizens, make_facilities  # noqa: E402
+
+
+# the loop Hello.py used before the vectorized engine
+def loop_assignment(citizens_subset, hospitals_subset):
+    citizens_subset = citizens_subset.copy()
+    for index_citizen, citizen in citizens_subset.iterrows():
+        distances = {}
+        for index_hospital, hospital in hospitals_subset.iterrows():
+            distance = haversine(citizen['Lat'], citizen['Long'], hospital['Lat'], hospital['Long'])
+            distances[hospital['Facility Name']] = distance
+        min_distance_hospital = min(distances, key=distances.get)
+        citizens_subset.at[index_citizen, 'Nearest_Hospital'] = min_distance_hospital
+        citizens_subset.at[index_citizen, 'Distance_to_Nearest_Hospital'] = distances[min_distance_hospital]
+    return citizens_subset
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the nearest-hospital assignment.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 100_000, 1_000_000])
+    parser.add_argument('--hospitals', type=int, default=40)
+    parser.add_argument('--loop-limit', type=int, default=2_000,
+                        help='largest citizen count the iterrows() loop is run on')
+    parser.add_argument('--chunk-size', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    hospitals = make_facilities(args.hospitals, args.seed)
+
+    print(f"{'citizens':>10} {'engine':>10} {'seconds':>10} {'citizens/s':>14}")
+    for n in args.sizes:
+        citizens = make_citizens(n, args.seed)
+        vectorized, seconds = timed(assign_nearest_hospital, citizens, hospitals, chunk_size=args.chunk_size)
+        print(f"{n:>10} {'vectorized':>10} {seconds:>10.3f} {n / seconds:>14,.0f}")
+
+        if n <= args.loop_limit:
+            looped, seconds = timed(loop_assignment, citizens, hospitals)
+            print(f"{n:>10} {'loop':>10} {seconds:>10.3f} {n / seconds:>14,.0f}")
+            assert (looped['Nearest_Hospital'] == vectorized['Nearest_Hospital']).all()
+            assert np.allclose(looped['Distance_to_Nearest_Hospital'], vectorized['Distance_to_Nearest_Hospital'])
+
+
+if __name__ == '__main__':
+    main()
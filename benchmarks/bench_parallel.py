@@ -0,0 +1,41 @@
+# Benchmark: multi-province pipeline
+#
+# Times parallel.national_coverage() on synthetic registers of the 18
+# provinces (synthetic.py) with an increasing number of worker processes, and
+# reports the speedup over one worker.
+#
+#   python benchmarks/bench_parallel.py --citizens 2000000 --workers 1 2 4 8
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from parallel import national_coverage  # noqa: E402
+from synthetic import make_citizens, make_facilities  # noqa: E402
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the multi-province pipeline.')
+    parser.add_argument('--citizens', type=int, default=2_000_000)
+    parser.add_argument('--hospitals', type=int, default=5_000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    citizens, hospitals = make_citizens(args.citizens, args.seed), make_facilities(args.hospitals, args.seed)
+    print(f"{'workers':>8} {'seconds':>10} {'speedup':>8}")
+    baseline = None
+    for workers in sorted(set(args.workers)):
+        start = time.perf_counter()
+        national_coverage(citizens, hospitals, workers=workers)
+        seconds = time.perf_counter() - start
+        baseline = baseline or seconds
+        print(f"{workers:>8} {seconds:>10.3f} {baseline / seconds:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# Benchmark: app startup
+#
+# Starts Hello.py in a fresh Python process per repeat (so no module or
+# Streamlit cache is warm) through Streamlit's AppTest and reports
+#   first paint   script start until the workplace selector is drawn
+#   landing run   the whole first script run
+#   first report  opening Government > Get overall report afterwards, i.e. the
+#                 pipeline stages the landing page no longer runs
+#
+#   python benchmarks/bench_startup.py --repeat 5
+#
+# The registers come from the usual Parquet cache (ANGOVAX_CACHE_DIR); run the
+# app or cli.py once first so no download is timed.
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Hello.py')
+
+# runs in the child process, prints one JSON line
+CHILD = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+from streamlit.testing.v1 import AppTest
+from diagnostics import DIAGNOSTICS
+
+at = AppTest.from_file({app!r}, default_timeout=600)
+start = time.perf_counter()
+at.run()
+landing = time.perf_counter() - start
+paint = [record['seconds'] for record in DIAGNOSTICS.to_list() if record['name'] == 'first_paint']
+
+start = time.perf_counter()
+at.selectbox[0].select('Government').run()
+at.radio[0].set_value('Get overall report').run()
+report = time.perf_counter() - start
+print(json.dumps({{'first_paint': paint[0] if paint else landing, 'landing_run': landing, 'first_report': report,
+                  'errors': [str(e.value) for e in at.exception]}}))
+"""
+
+
+def run_once():
+    root = os.path.dirname(APP)
+    output = subprocess.run([sys.executable, '-c', CHILD.format(root=root, app=APP)], cwd=root,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the startup of the Streamlit app.')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    runs = [run_once() for _ in range(args.repeat)]
+    for run in runs:
+        if run['errors']:
+            print(f"app raised: {run['errors']}", file=sys.stderr)
+    print(f"{'':>14} {'median s':>10} {'min s':>8}")
+    for key in ('first_paint', 'landing_run', 'first_report'):
+        values = [run[key] for run in runs]
+        print(f"{key:>14} {statistics.median(values):>10.3f} {min(values):>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+# Benchmark suite for the pipeline stages
+#
+# Times every stage of the pipeline on synthetic registers (benchmarks/synthetic.py)
+# at several scales, with the old loops from Hello.py as reference at small
+# scales. Each stage is timed over several runs, the fastest counts (short
+# stages are called in a loop per run, as timeit does), and run once more
+# under tracemalloc for its peak memory. Times are also taken relative to a
+# fixed reference workload that does not depend on this repo, so baselines
+# recorded on one machine can be checked on another. Results can be stored as
+# baselines and later runs checked against them:
+#
+#   python benchmarks/run_benchmarks.py --scales 1k 100k
+#   python benchmarks/run_benchmarks.py --scales 1k 100k --save-baselines
+#   python benchmarks/run_benchmarks.py --scales 1k 100k --check     # exit 1 on a regression
+#   python benchmarks/run_benchmarks.py --scales 10M --no-memory --repeat 1    # ~10 GB RAM
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import timeit
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_nearest_hospital import loop_assignment  # noqa: E402
+from synthetic import make_citizens, make_facilities, facilities_for  # noqa: E402
+from coverage import CoverageView, coverage_matrix  # noqa: E402
+from distribution import distribute  # noqa: E402
+from geo import FacilityIndex, assign_nearest_hospital, haversine, haversine_np  # noqa: E402
+from patients import PatientRegistry  # noqa: E402
+from vaccines import vaccine_age_recommendations_years_int  # noqa: E402
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+SCALES = {'1k': 1_000, '100k': 100_000, '1M': 1_000_000, '10M': 10_000_000}
+
+# the old loops are only run up to this many citizens
+LOOP_LIMIT = 1_000
+
+# timed runs per stage, the fastest one is the stage's time
+REPEAT = 5
+
+# share a stage may be slower (or use more memory) than its baseline before --check fails
+TOLERANCE = 0.5
+
+# timings under this many seconds are too noisy to compare
+MIN_SECONDS = 0.01
+
+
+# the per vaccine counting loop Hello.py used before coverage_matrix()
+def loop_coverage(citizens, hospitals):
+    hospitals = hospitals.copy()
+    for vaccine, age_range in vaccine_age_recommendations_years_int.items():
+        eligible_individuals = citizens[(citizens['Age'] >= age_range[0]) & (citizens['Age'] <= age_range[1])]
+        for index, hospital in hospitals.iterrows():
+            at_hospital = eligible_individuals['Nearest_Hospital'] == hospital['Facility Name']
+            hospitals.loc[index, f'{vaccine}_Citizen_Count'] = at_hospital.sum()
+            hospitals.loc[index, f'{vaccine}_Vaccinated_Count'] = (at_hospital & (eligible_individuals[vaccine] == 1)).sum()
+    return hospitals
+
+
+def haversine_loop(citizens, hospitals):
+    lat, lon = citizens['Lat'].tolist(), citizens['Long'].tolist()
+    hospital_lat, hospital_lon = float(hospitals['Lat'].iat[0]), float(hospitals['Long'].iat[0])
+    return [haversine(lat[i], lon[i], hospital_lat, hospital_lon) for i in range(len(lat))]
+
+
+def country_report(view):
+    # the queries country_report() and its drill-downs make
+    view.vaccine_table(Country='Angola')
+    view.rollup('Country', Country='Angola')
+    for city in view.values('City', Country='Angola'):
+        view.vaccine_table(Country='Angola', City=city)
+    for vaccine in view.vaccines:
+        view.breakdown(vaccine, 'City', Country='Angola')
+
+
+def stages(n, seed):
+    """(name, function, rows) per stage; each function runs the stage from prepared inputs."""
+    citizens = make_citizens(n, seed)
+    hospitals = make_facilities(facilities_for(n), seed)
+    index = FacilityIndex(hospitals)
+    assigned = assign_nearest_hospital(citizens, hospitals, index=index)
+    registry = PatientRegistry(assigned, hospitals, index=index)
+    view = CoverageView.from_registry(registry)
+    coverage = view.hospital_frame()
+    stock = {vaccine: int(coverage[f'{vaccine}_Not_Vaccinated_Count'].sum()) // 2 for vaccine in view.vaccines}
+
+    yield 'generate', lambda: (make_citizens(n, seed), make_facilities(facilities_for(n), seed)), n
+    if n <= LOOP_LIMIT:
+        yield 'haversine_loop', lambda: haversine_loop(citizens, hospitals), n
+    yield 'haversine_np', lambda: haversine_np(citizens['Lat'], citizens['Long'],
+                                               hospitals['Lat'].iat[0], hospitals['Long'].iat[0]), n
+    if n <= LOOP_LIMIT:
+        yield 'nearest_loop', lambda: loop_assignment(citizens, hospitals), n
+    yield 'nearest_dense', lambda: assign_nearest_hospital(citizens, hospitals), n
+    yield 'nearest_index', lambda: assign_nearest_hospital(citizens, hospitals, index=index), n
+    if n <= LOOP_LIMIT:
+        yield 'coverage_loop', lambda: loop_coverage(assigned, hospitals), n
+    yield 'coverage_matrix', lambda: coverage_matrix(assigned), n
+    yield 'registry', lambda: PatientRegistry(assigned, hospitals, index=index), n
+    yield 'coverage_view', lambda: CoverageView.from_registry(registry), n
+    yield 'country_report', lambda: country_report(view), n
+    yield 'distribute', lambda: distribute(coverage, stock), len(coverage)
+
+
+def reference_workload():
+    # fixed NumPy and pure Python work, the yardstick for the speed of the machine
+    np.sort(np.random.default_rng(0).random(2_000_000))
+    sum(i * i for i in range(1_000_000))
+
+
+def measure(func, memory=True, repeat=REPEAT):
+    """(fastest seconds, median seconds, peak MB or None) per call of func over repeat timed runs.
+
+    A timed run calls func as often as it takes to last at least 0.2 s
+    (timeit's autorange), so fast stages are not timed from a single call.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    times = [seconds / number for seconds in timer.repeat(max(repeat, 1), number)]
+    peak_mb = None
+    if memory:
+        tracemalloc.start()
+        try:
+            func()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        finally:
+            tracemalloc.stop()
+    return min(times), statistics.median(times), peak_mb
+
+
+def check(results, baselines, tolerance=TOLERANCE):
+    """Messages for every result slower or hungrier than its baseline by more than tolerance.
+
+    Times are compared as multiples of the reference workload of their own
+    run, so a faster or slower machine does not count as a change.
+    """
+    regressions = []
+    for key, result in results.items():
+        baseline = baselines.get(key)
+        if baseline is None or 'relative' not in result or 'relative' not in baseline:
+            continue
+        if result['seconds'] > MIN_SECONDS and result['relative'] > baseline['relative'] * (1 + tolerance):
+            regressions.append(f"{key}: {result['relative']:.3f} x reference, baseline {baseline['relative']:.3f} x "
+                               f"reference ({result['seconds']:.3f} s, baseline {baseline['seconds']:.3f} s)")
+        if result.get('peak_mb') and baseline.get('peak_mb') and result['peak_mb'] > baseline['peak_mb'] * (1 + tolerance):
+            regressions.append(f"{key}: {result['peak_mb']:.1f} MB peak, baseline {baseline['peak_mb']:.1f} MB")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline stages on synthetic registers.')
+    parser.add_argument('--scales', nargs='+', default=['1k', '100k'], choices=list(SCALES))
+    parser.add_argument('--stages', nargs='+', default=None, help='only these stages')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='timed runs per stage, the fastest counts')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc runs')
+    parser.add_argument('--baselines', default=BASELINES_PATH)
+    parser.add_argument('--save-baselines', action='store_true', help='store the results as the new baselines')
+    parser.add_argument('--check', action='store_true', help='exit 1 if a stage regressed against its baseline')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--json', default=None, help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    reference, median, _ = measure(reference_workload, memory=False, repeat=args.repeat)
+    results = {'reference': {'seconds': round(reference, 4), 'median': round(median, 4)}}
+    print(f"reference workload {reference:.4f} s")
+    print(f"{'scale':>6} {'stage':>16} {'seconds':>10} {'median':>10} {'x ref':>7} {'rows/s':>14} {'peak MB':>9}")
+    for scale in args.scales:
+        n = SCALES[scale]
+        for name, func, rows in stages(n, args.seed):
+            if args.stages and name not in args.stages:
+                continue
+            seconds, median, peak_mb = measure(func, memory=not args.no_memory, repeat=args.repeat)
+            results[f'{name}@{scale}'] = {'seconds': round(seconds, 4), 'median': round(median, 4),
+                                          'relative': round(seconds / reference, 4), 'rows': rows,
+                                          'peak_mb': None if peak_mb is None else round(peak_mb, 2)}
+            peak = '' if peak_mb is None else f'{peak_mb:.1f}'
+            print(f"{scale:>6} {name:>16} {seconds:>10.4f} {median:>10.4f} {seconds / reference:>7.3f} "
+                  f"{rows / max(seconds, 1e-9):>14,.0f} {peak:>9}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines, encoding='utf-8') as file:
+            baselines = json.load(file)
+    if args.save_baselines:
+        baselines.update(results)
+        with open(args.baselines, 'w', encoding='utf-8') as file:
+            json.dump(dict(sorted(baselines.items())), file, indent=2)
+            file.write('\n')
+        print(f"Saved {len(results)} baselines to {args.baselines}")
+    if args.check:
+        regressions = check(results, baselines, args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+# Synthetic registers for the benchmarks
+#
+# Citizens and facilities shaped like the real Angolan registers: the 18
+# provinces with their capitals' coordinates and population shares, citizens
+# clustered around the capitals, a young age pyramid and 0/1 vaccine columns.
+# Everything is drawn from one seeded generator, so a scale and seed always
+# give the same data.
+#
+#   python benchmarks/synthetic.py --citizens 100000 --out /tmp/synthetic
+
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vaccines import vaccine_abbreviations  # noqa: E402
+
+# province: (capital latitude, capital longitude, population in millions)
+PROVINCES = {
+    'Luanda': (-8.84, 13.23, 8.3),
+    'Huila': (-14.92, 13.49, 2.9),
+    'Benguela': (-12.58, 13.41, 2.6),
+    'Huambo': (-12.78, 15.74, 2.3),
+    'Cuanza Sul': (-11.21, 13.85, 2.1),
+    'Uige': (-7.61, 15.06, 1.7),
+    'Bie': (-12.38, 16.93, 1.6),
+    'Malanje': (-9.54, 16.34, 1.1),
+    'Cunene': (-17.07, 15.73, 1.1),
+    'Lunda Norte': (-7.37, 20.83, 1.0),
+    'Moxico': (-11.78, 19.92, 0.9),
+    'Cabinda': (-5.55, 12.20, 0.8),
+    'Zaire': (-6.27, 14.24, 0.7),
+    'Lunda Sul': (-9.66, 20.39, 0.6),
+    'Cuando Cubango': (-14.66, 17.69, 0.6),
+    'Namibe': (-15.20, 12.15, 0.6),
+    'Bengo': (-8.58, 13.66, 0.5),
+    'Cuanza Norte': (-9.30, 14.91, 0.5),
+}
+
+# rough bounding box of Angola, points are clipped to it
+LAT_RANGE = (-18.0, -4.4)
+LONG_RANGE = (11.7, 24.1)
+
+# share of citizens who have each vaccine
+VACCINATION_RATE = 0.55
+
+# mean age in years (exponential pyramid, most citizens are young)
+MEAN_AGE = 18
+
+
+def _places(n, spread, rng):
+    names = np.array(list(PROVINCES))
+    weights = np.array([population for _, _, population in PROVINCES.values()])
+    province = rng.choice(len(names), size=n, p=weights / weights.sum())
+    centres = np.array([(lat, long) for lat, long, _ in PROVINCES.values()])
+    lat = np.clip(centres[province, 0] + rng.normal(0, spread, n), *LAT_RANGE)
+    long = np.clip(centres[province, 1] + rng.normal(0, spread, n), *LONG_RANGE)
+    return names[province], lat, long
+
+
+def make_citizens(n, seed=0):
+    """n citizens with ID, Age, Gender, City (province), Country, Lat, Long and a 0/1 column per vaccine."""
+    rng = np.random.default_rng(seed)
+    province, lat, long = _places(n, 0.4, rng)
+    citizens = pd.DataFrame({
+        'ID': np.arange(1, n + 1),
+        'Age': np.minimum(rng.exponential(MEAN_AGE, n).astype(np.int64), 90),
+        'Gender': rng.choice(np.array(['F', 'M']), size=n),
+        'City': province,
+        'Country': 'Angola',
+        'Lat': lat,
+        'Long': long,
+    })
+    for vaccine in vaccine_abbreviations:
+        citizens[vaccine] = (rng.random(n) < VACCINATION_RATE).astype(np.int64)
+    return citizens
+
+
+def make_facilities(n, seed=0):
+    """n facilities (at least one per province, the first being its provincial hospital)."""
+    rng = np.random.default_rng(seed + 1)
+    n = max(n, len(PROVINCES))
+    province, lat, long = _places(n - len(PROVINCES), 0.8, rng)
+    capitals = pd.DataFrame({
+        'Country': 'Angola',
+        'City': list(PROVINCES),
+        'Facility Name': [f'Hospital Provincial de {name}' for name in PROVINCES],
+        'Lat': [lat for lat, _, _ in PROVINCES.values()],
+        'Long': [long for _, long, _ in PROVINCES.values()],
+    })
+    others = pd.DataFrame({
+        'Country': 'Angola',
+        'City': province,
+        'Facility Name': [f'Centro de Saude {i}' for i in range(1, len(province) + 1)],
+        'Lat': lat,
+        'Long': long,
+    })
+    return pd.concat([capitals, others], ignore_index=True)
+
+
+def facilities_for(n_citizens):
+    """Facility count that goes with a citizen count (about one per 2000 citizens)."""
+    return max(20, n_citizens // 2000)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write synthetic citizen and facility registers.')
+    parser.add_argument('--citizens', type=int, default=100_000)
+    parser.add_argument('--facilities', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='synthetic')
+    parser.add_argument('--format', choices=['parquet', 'csv', 'xlsx'], default='parquet')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.out, exist_ok=True)
+    registers = {'citizens': make_citizens(args.citizens, args.seed),
+                 'facilities': make_facilities(args.facilities or facilities_for(args.citizens), args.seed)}
+    for name, frame in registers.items():
+        path = os.path.join(args.out, f'{name}.{args.format}')
+        if args.format == 'parquet':
+            frame.to_parquet(path, index=False)
+        elif args.format == 'csv':
+            frame.to_csv(path, index=False)
+        else:
+            frame.to_excel(path, index=False)
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
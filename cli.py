@@ -0,0 +1,82 @@
+# Batch run of the AngoVaxTracker pipeline, without Streamlit
+#
+# Runs load -> nearest hospital assignment -> coverage aggregation -> export,
+# e.g. nightly from cron, and writes the results where the app picks them up
+# (pipeline.BATCH_DIR, see pipeline.load_batch):
+#
+#   python cli.py --province Bengo
+#   python cli.py --province all --workers 8 --format parquet csv --output /data/angovax
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+import pipeline
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Recompute the nearest hospitals and the vaccine coverage.')
+    parser.add_argument('--citizens', default=pipeline.CITIZENS_URL, help='citizen register (URL or path)')
+    parser.add_argument('--facilities', default=pipeline.FACILITIES_URL, help='facility register (URL or path)')
+    parser.add_argument('--country', default='Angola')
+    parser.add_argument('--province', default='Bengo',
+                        help="province (City column) to process, 'all' for every province of the country")
+    parser.add_argument('--limit', type=int, default=None, help='only the first LIMIT citizens (single province)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help="worker processes for --province all (default: one per core)")
+    parser.add_argument('--stream', action='store_true',
+                        help='read the citizen file in chunks (csv, xlsx or parquet) instead of at once')
+    parser.add_argument('--output', default=pipeline.BATCH_DIR, help='output directory')
+    parser.add_argument('--format', nargs='+', default=['parquet'], choices=['parquet', 'csv'],
+                        help='output formats; parquet, which the app reads, is always written')
+    args = parser.parse_args(argv)
+    if args.province == 'all' and (args.limit is not None or args.stream):
+        parser.error("--limit and --stream work on a single province, not with --province all")
+    return args
+
+
+def run(args):
+    timings = {}
+
+    def stage(name, func, *func_args, **kwargs):
+        start = time.perf_counter()
+        result = func(*func_args, **kwargs)
+        timings[name] = round(time.perf_counter() - start, 3)
+        print(f"{name:<12} {timings[name]:>8.3f} s", file=sys.stderr)
+        return result
+
+    if args.province == 'all':
+        citizens, hospitals = stage('national', pipeline.national_registers, args.citizens, args.facilities,
+                                    country=args.country, workers=args.workers)
+    else:
+        if args.stream:
+            # the citizens go to a Parquet file chunk by chunk and never into memory at once
+            citizens, hospitals = stage('load+assign', pipeline.stream_registers, args.citizens, args.facilities,
+                                        country=args.country, city=args.province, limit=args.limit,
+                                        out_path=os.path.join(args.output, 'citizens.streamed.parquet'))
+            hospitals = stage('coverage', pipeline.streamed_coverage, citizens, hospitals)
+        else:
+            citizens, hospitals = stage('load', pipeline.load_registers, args.citizens, args.facilities,
+                                        country=args.country, city=args.province, limit=args.limit)
+            citizens = stage('assign', pipeline.geo_assignment, citizens, hospitals,
+                             index=pipeline.build_facility_index(hospitals))
+            hospitals = stage('coverage', pipeline.hospital_coverage, citizens, hospitals)
+
+    manifest = {'created': datetime.now(timezone.utc).isoformat(), 'citizens_source': str(args.citizens),
+                'facilities_source': str(args.facilities), 'country': args.country, 'province': args.province,
+                'timings': timings}
+    paths = stage('export', pipeline.export_batch, citizens, hospitals, args.output, formats=args.format,
+                  manifest=manifest)
+    for path in paths:
+        print(path)
+    return paths
+
+
+def main(argv=None):
+    run(parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+# Vaccine coverage aggregation for AngoVaxTracker
+#
+# Computes, for every hospital and vaccine, how many assigned citizens are in
+# the recommended age range and how many of them are (not) vaccinated.
+# coverage_matrix() aggregates a citizen table in one pass; CoverageView keeps
+# the same numbers per country / city / hospital current while patients are
+# added or vaccinated.
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+from vaccines import vaccine_age_recommendations_years_int, vaccine_bits
+
+
+def coverage_columns(vaccines):
+    """Column names of the wide coverage frame, in the order Hello.py has always used."""
+    columns = ['Citizens']
+    for vaccine in vaccines:
+        columns += [f'{vaccine}_Citizen_Count', f'{vaccine}_Vaccinated_Count', f'{vaccine}_Not_Vaccinated_Count']
+    return columns
+
+
+def eligibility_matrix(ages, age_ranges=vaccine_age_recommendations_years_int):
+    """Boolean (citizens x vaccines) matrix, True where the age is in the vaccine's range."""
+    ages = np.asarray(ages, dtype=np.float64)[:, None]
+    low = np.array([age_range[0] for age_range in age_ranges.values()], dtype=np.float64)
+    high = np.array([age_range[1] for age_range in age_ranges.values()], dtype=np.float64)
+    return (ages >= low) & (ages <= high)
+
+
+def vaccinated_matrix(citizens, vaccines):
+    """Boolean (citizens x vaccines) matrix, True where the vaccine column is 1 (missing counts as not vaccinated)."""
+    return np.column_stack([citizens[vaccine].to_numpy(dtype=np.float64, na_value=np.nan) == 1 if vaccine in citizens
+                            else np.zeros(len(citizens), dtype=bool) for vaccine in vaccines]).reshape(len(citizens), len(vaccines))
+
+
+def coverage_matrix(citizens, age_ranges=vaccine_age_recommendations_years_int, by='Nearest_Hospital'):
+    """Hospital x vaccine coverage counts in one groupby pass over the citizens.
+
+    Returns a wide frame indexed by hospital name with the columns from
+    coverage_columns(): Citizens, then {vaccine}_Citizen_Count,
+    {vaccine}_Vaccinated_Count and {vaccine}_Not_Vaccinated_Count per vaccine.
+    """
+    vaccines = list(age_ranges)
+    eligible = eligibility_matrix(citizens['Age'], age_ranges)
+    vaccinated = eligible & vaccinated_matrix(citizens, vaccines)
+
+    counts = pd.DataFrame(np.hstack([eligible, vaccinated]).astype(np.int64),
+                          columns=[f'{v}_Citizen_Count' for v in vaccines] + [f'{v}_Vaccinated_Count' for v in vaccines])
+    counts['Citizens'] = 1
+    grouped = counts.groupby(citizens[by].to_numpy(), sort=False).sum()
+
+    for vaccine in vaccines:
+        grouped[f'{vaccine}_Not_Vaccinated_Count'] = grouped[f'{vaccine}_Citizen_Count'] - grouped[f'{vaccine}_Vaccinated_Count']
+    grouped.index.name = by
+    return grouped[coverage_columns(vaccines)]
+
+
+def join_coverage(hospitals, coverage, on='Facility Name'):
+    """hospitals with the coverage counts joined on; hospitals without citizens get zeros."""
+    hospitals = hospitals.drop(columns=[c for c in coverage.columns if c in hospitals])
+    joined = hospitals.join(coverage, on=on)
+    joined[list(coverage.columns)] = joined[list(coverage.columns)].fillna(0).astype(np.int64)
+    return joined
+
+
+# a cell of the coverage view: where the citizen lives and the hospital they belong to
+PLACE_COLUMNS = ['Country', 'City', 'Nearest_Hospital']
+
+# place of citizens without a value, e.g. no Nearest_Hospital because they have no coordinates
+UNKNOWN = 'Unknown'
+
+
+def _unpack(masks, bits):
+    # (n,) uint16 bitmasks -> (n, vaccines) 0/1 matrix
+    return ((np.asarray(masks, dtype=np.uint16)[:, None] & bits) != 0).astype(np.int64)
+
+
+def _bincount(codes, weights, size):
+    # column wise bincount of an (n, k) weight matrix
+    return np.column_stack([np.bincount(codes, weights=weights[:, j], minlength=size) for j in range(weights.shape[1])]
+                           ).astype(np.int64).reshape(size, weights.shape[1])
+
+
+class CoverageView:
+    """Materialized coverage per (Country, City, Nearest_Hospital) cell and vaccine.
+
+    Built once from a PatientRegistry; apply() is registered in the registry's
+    on_update listeners and adjusts only the cells of the changed citizens, so
+    the table never has to be re-aggregated. The cells form the country ->
+    city -> hospital hierarchy; every report (rollup, vaccine_table, breakdown)
+    is a filtered sum over cells, so its cost depends on the number of places,
+    not citizens. apply() and the reports take the view's lock, so a report
+    never sees the cells and count arrays of different updates.
+    """
+
+    def __init__(self, age_ranges=vaccine_age_recommendations_years_int):
+        self.vaccines = list(age_ranges)
+        self.bits = np.array([vaccine_bits[vaccine] for vaccine in self.vaccines], dtype=np.uint16)
+        self.cells = pd.MultiIndex.from_arrays([[], [], []], names=PLACE_COLUMNS)
+        self.citizens = np.zeros(0, dtype=np.int64)
+        self.any_eligible = np.zeros(0, dtype=np.int64)
+        self.eligible = np.zeros((0, len(self.vaccines)), dtype=np.int64)
+        self.vaccinated = np.zeros_like(self.eligible)
+        self.lock = threading.RLock()
+
+    @classmethod
+    def from_registry(cls, registry, subscribe=False):
+        """View of a registry's citizens; with subscribe it is kept up to date through registry.on_update.
+
+        Built (and subscribed) under the registry's lock, so no registration or
+        status update can fall between reading the registry and subscribing.
+        """
+        view = cls()
+        with registry.lock:
+            view.apply(registry.citizens[PLACE_COLUMNS], registry.eligible, None, registry.status)
+            if subscribe:
+                registry.on_update.append(view.apply)
+        return view
+
+    def _codes(self, places):
+        keys = pd.MultiIndex.from_frame(places[PLACE_COLUMNS].astype(object).fillna(UNKNOWN))
+        codes = self.cells.get_indexer(keys)
+        unknown = codes < 0
+        if unknown.any():
+            # first citizens of a new place
+            new = keys[unknown].unique()
+            self.cells = self.cells.append(new)
+            self.citizens = np.concatenate([self.citizens, np.zeros(len(new), dtype=np.int64)])
+            self.any_eligible = np.concatenate([self.any_eligible, np.zeros(len(new), dtype=np.int64)])
+            self.eligible = np.vstack([self.eligible, np.zeros((len(new), len(self.vaccines)), dtype=np.int64)])
+            self.vaccinated = np.vstack([self.vaccinated, np.zeros((len(new), len(self.vaccines)), dtype=np.int64)])
+            codes = self.cells.get_indexer(keys)
+        return codes
+
+    def apply(self, places, eligible, old_status, new_status):
+        """Add citizens (old_status None) or move vaccinated counts from old_status to new_status.
+
+        places is a frame with the PLACE_COLUMNS of the affected citizens, the
+        other arguments are their uint16 eligibility and status bitmasks.
+        """
+        eligible = np.asarray(eligible, dtype=np.uint16)
+        vaccinated = _unpack(eligible & np.asarray(new_status, dtype=np.uint16), self.bits)
+        if old_status is not None:
+            vaccinated = vaccinated - _unpack(eligible & np.asarray(old_status, dtype=np.uint16), self.bits)
+        with self.lock:
+            codes = self._codes(places)
+            size = len(self.cells)
+            if old_status is None:
+                self.citizens += np.bincount(codes, minlength=size)
+                self.any_eligible += np.bincount(codes, weights=eligible != 0, minlength=size).astype(np.int64)
+                self.eligible += _bincount(codes, _unpack(eligible, self.bits), size)
+            self.vaccinated += _bincount(codes, vaccinated, size)
+
+    def _select(self, filters):
+        selected = np.ones(len(self.cells), dtype=bool)
+        for level, value in filters.items():
+            selected &= self.cells.get_level_values(level) == value
+        return selected
+
+    def values(self, level, **filters):
+        """Distinct values of one level (e.g. the cities of a country) that have citizens."""
+        with self.lock:
+            selected = self._select(filters) & (self.citizens > 0)
+            return list(pd.unique(self.cells.get_level_values(level)[selected]))
+
+    def rollup(self, level, **filters):
+        """Counts summed per value of level over the cells matching filters (e.g. Country='Angola').
+
+        Columns: Citizens, Eligible_Any (eligible for at least one vaccine), and
+        {vaccine}_Eligible / {vaccine}_Vaccinated per vaccine.
+        """
+        with self.lock:
+            selected = self._select(filters)
+            counts = np.column_stack([self.citizens, self.any_eligible, self.eligible, self.vaccinated])[selected]
+            groups = self.cells.get_level_values(level)[selected]
+        frame = pd.DataFrame(counts, columns=['Citizens', 'Eligible_Any'] + [f'{v}_Eligible' for v in self.vaccines]
+                             + [f'{v}_Vaccinated' for v in self.vaccines])
+        return frame.groupby(groups, sort=False).sum()
+
+    def vaccine_table(self, **filters):
+        """Per vaccine eligible, vaccinated and coverage rate over the cells matching filters."""
+        with self.lock:
+            selected = self._select(filters)
+            eligible = self.eligible[selected].sum(axis=0)
+            vaccinated = self.vaccinated[selected].sum(axis=0)
+        rate = np.divide(vaccinated, eligible, out=np.zeros(len(self.vaccines)), where=eligible > 0).round(4)
+        return pd.DataFrame({'Eligible & Vaccinated': vaccinated, 'Eligible Total': eligible, 'Coverage Rate': rate},
+                            index=pd.Index(self.vaccines, name='Vaccine'))
+
+    def breakdown(self, vaccine, level, **filters):
+        """One vaccine's eligible, vaccinated, not vaccinated and coverage rate per value of level."""
+        totals = self.rollup(level, **filters)
+        eligible, vaccinated = totals[f'{vaccine}_Eligible'], totals[f'{vaccine}_Vaccinated']
+        rate = np.divide(vaccinated, eligible, out=np.zeros(len(totals)), where=eligible > 0).round(4)
+        frame = pd.DataFrame({'Eligible & Vaccinated': vaccinated, 'Eligible Total': eligible,
+                              'Not Vaccinated': eligible - vaccinated, 'Coverage Rate': rate})
+        return frame.sort_values('Coverage Rate')
+
+    def hospital_frame(self):
+        """Same layout as coverage_matrix(), indexed by hospital name."""
+        # citizens without a hospital are left out, as in coverage_matrix()
+        totals = self.rollup('Nearest_Hospital').drop(index=UNKNOWN, errors='ignore')
+        frame = pd.DataFrame({'Citizens': totals['Citizens']})
+        for vaccine in self.vaccines:
+            frame[f'{vaccine}_Citizen_Count'] = totals[f'{vaccine}_Eligible']
+            frame[f'{vaccine}_Vaccinated_Count'] = totals[f'{vaccine}_Vaccinated']
+            frame[f'{vaccine}_Not_Vaccinated_Count'] = totals[f'{vaccine}_Eligible'] - totals[f'{vaccine}_Vaccinated']
+        frame.index.name = 'Nearest_Hospital'
+        return frame
@@ -0,0 +1,142 @@
+# Local columnar cache for the citizen and facility registers
+#
+# The registers are published as Excel workbooks. Downloading and parsing them
+# with openpyxl on every Streamlit rerun is slow, so each source is converted
+# once to Parquet and later runs memory-map the Parquet file instead.
+#
+# Cache entries are keyed by the source (URL or local path). For URLs the
+# server's ETag is checked with a HEAD request and, if it changed or is
+# missing, the download's SHA-256 decides whether the Parquet file has to be
+# rebuilt. Local files are keyed by their SHA-256. Without network the last
+# cached copy is used.
+
+import hashlib
+import json
+import os
+from io import BytesIO
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import requests
+
+from diagnostics import stage
+
+CACHE_DIR = os.environ.get('ANGOVAX_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache'))
+REQUEST_TIMEOUT = 30  # seconds
+
+
+# Function to read an Excel file from a URL with specified engine (no caching)
+def read_excel_from_url(url):
+    response = requests.get(url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    file = BytesIO(response.content)
+    return pd.read_excel(file, engine='openpyxl')
+
+
+def is_url(source):
+    return str(source).startswith(('http://', 'https://'))
+
+
+def cache_paths(source, cache_dir=CACHE_DIR):
+    """(parquet path, metadata path) of the cache entry for a source."""
+    key = hashlib.sha1(str(source).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, f'{key}.parquet'), os.path.join(cache_dir, f'{key}.json')
+
+
+def sha256_file(path, block_size=1024 ** 2):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path, encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_meta(meta_path, meta):
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(meta, file, indent=2)
+    os.replace(tmp_path, meta_path)
+
+
+def _arrow_safe(df):
+    # Excel columns that mix numbers and text cannot be stored as one Arrow type
+    df = df.copy()
+    df.columns = [str(column) for column in df.columns]
+    for column in df.columns[df.dtypes == object]:
+        if pd.api.types.infer_dtype(df[column], skipna=True).startswith('mixed'):
+            df[column] = df[column].map(lambda value: value if pd.isna(value) else str(value))
+    return df
+
+
+def convert_excel_to_parquet(excel, parquet_path):
+    """One-time conversion of a workbook (path or file object) to a Parquet file. Returns the frame."""
+    df = pd.read_excel(excel, engine='openpyxl')
+    os.makedirs(os.path.dirname(parquet_path) or '.', exist_ok=True)
+    tmp_path = parquet_path + '.tmp'
+    pq.write_table(pa.Table.from_pandas(_arrow_safe(df), preserve_index=False), tmp_path)
+    os.replace(tmp_path, parquet_path)
+    return df
+
+
+def read_parquet_mmap(parquet_path):
+    """Load a cached Parquet file through a memory map instead of buffered reads."""
+    return pq.read_table(parquet_path, memory_map=True).to_pandas()
+
+
+def cached_sha256(source, cache_dir=CACHE_DIR):
+    """SHA-256 of the source's content as last cached, None if it is not cached."""
+    parquet_path, meta_path = cache_paths(source, cache_dir)
+    return _read_meta(meta_path).get('sha256') if os.path.exists(parquet_path) else None
+
+
+def load_register(source, cache_dir=CACHE_DIR, offline=False):
+    """Load an Excel register from a URL or local path through the Parquet cache.
+
+    With offline=True (or when the network is unreachable) an existing cache
+    entry is returned without contacting the server.
+    """
+    parquet_path, meta_path = cache_paths(source, cache_dir)
+    meta = _read_meta(meta_path) if os.path.exists(parquet_path) else {}
+
+    if not is_url(source):
+        stat = os.stat(source)
+        # size and mtime unchanged -> skip hashing the file again
+        if meta and meta.get('size') == stat.st_size and meta.get('mtime') == stat.st_mtime:
+            return read_parquet_mmap(parquet_path)
+        digest = sha256_file(source)
+        if meta.get('sha256') != digest:
+            with stage('excel_to_parquet'):
+                convert_excel_to_parquet(source, parquet_path)
+        _write_meta(meta_path, {'source': str(source), 'sha256': digest, 'size': stat.st_size, 'mtime': stat.st_mtime})
+        return read_parquet_mmap(parquet_path)
+
+    if meta:
+        if offline:
+            return read_parquet_mmap(parquet_path)
+        try:
+            etag = requests.head(source, allow_redirects=True, timeout=REQUEST_TIMEOUT).headers.get('ETag')
+        except requests.RequestException:
+            return read_parquet_mmap(parquet_path)
+        if etag and etag == meta.get('etag'):
+            return read_parquet_mmap(parquet_path)
+    elif offline:
+        raise FileNotFoundError(f"No cached copy of {source} in {cache_dir}.")
+
+    with stage('download'):
+        response = requests.get(source, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+    digest = hashlib.sha256(response.content).hexdigest()
+    if meta.get('sha256') != digest:
+        with stage('excel_to_parquet'):
+            convert_excel_to_parquet(BytesIO(response.content), parquet_path)
+    _write_meta(meta_path, {'source': source, 'sha256': digest, 'etag': response.headers.get('ETag')})
+    return read_parquet_mmap(parquet_path)
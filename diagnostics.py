@@ -0,0 +1,173 @@
+# Stage diagnostics for AngoVaxTracker
+#
+# Records wall time, rows processed and the change in the process's resident
+# memory of every pipeline stage and menu handler, so a slow app shows where
+# the time goes (download, assignment, coverage, registry, ...). Stages are
+# timed with a context manager or a decorator:
+#
+#   with stage('geo_assignment') as record:
+#       citizens = assign_nearest_hospital(citizens, hospitals)
+#       record.rows = len(citizens)
+#
+#   @timed('load_registers', rows=lambda result: len(result[0]))
+#   def load_registers(): ...
+#
+# The records are kept in memory (the last MAX_RECORDS) for the sidebar panel
+# in Hello.py and can be exported as JSON for monitoring.
+
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+
+MAX_RECORDS = 500
+
+# file the app rewrites with the records after every rerun, for monitoring (off when unset)
+EXPORT_PATH = os.environ.get('ANGOVAX_DIAGNOSTICS')
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def rss_mb():
+    """Resident memory of this process in MB (peak RSS where the current one is unknown, None on Windows)."""
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * _PAGE_SIZE / 1024 ** 2
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KB elsewhere
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+@dataclass
+class StageRecord:
+    name: str
+    started: str
+    seconds: float = 0.0
+    rows: int = None
+    memory_mb: float = None  # change in resident memory over the stage
+    error: str = None
+    parent: str = None  # the stage this one ran in
+
+
+class Diagnostics:
+    """Thread-safe collection of StageRecords, the last max_records of them."""
+
+    def __init__(self, max_records=MAX_RECORDS):
+        self.records = deque(maxlen=max_records)
+        self.lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def stage(self, name, rows=None):
+        """Context manager timing a stage; set .rows on the yielded record when the count is known at the end."""
+        return _Stage(self, name, rows)
+
+    def timed(self, name=None, rows=None):
+        """Decorator timing every call of a function; rows is a count or a function of the result."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name or func.__name__) as record:
+                    result = func(*args, **kwargs)
+                    record.rows = rows(result) if callable(rows) else rows
+                    return result
+            return wrapper
+        return decorator
+
+    def record(self, name, seconds, rows=None):
+        """Add a duration measured elsewhere (e.g. from script start to first paint) as a record."""
+        stack = self._stack()
+        self.add(StageRecord(name=name, started=datetime.now(timezone.utc).isoformat(), seconds=round(seconds, 4),
+                             rows=rows, parent=stack[-1] if stack else None))
+
+    def add(self, record):
+        with self.lock:
+            self.records.append(record)
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+
+    def to_list(self):
+        with self.lock:
+            return [asdict(record) for record in self.records]
+
+    def summary(self):
+        """Calls, total / mean / max seconds, rows and memory change per stage name, slowest first."""
+        import pandas as pd
+        records = pd.DataFrame(self.to_list(), columns=list(StageRecord.__dataclass_fields__))
+        if records.empty:
+            return pd.DataFrame(columns=['Calls', 'Total s', 'Mean s', 'Max s', 'Rows', 'Memory MB'])
+        summary = records.groupby('name').agg(**{
+            'Calls': ('seconds', 'size'),
+            'Total s': ('seconds', 'sum'),
+            'Mean s': ('seconds', 'mean'),
+            'Max s': ('seconds', 'max'),
+            'Rows': ('rows', 'last'),
+            'Memory MB': ('memory_mb', 'sum'),
+        })
+        return summary.rename_axis('Stage').sort_values('Total s', ascending=False).round(3)
+
+    def to_json(self, indent=2):
+        """The records as a JSON document: {'process': ..., 'exported': ..., 'stages': [...]}."""
+        return json.dumps({'process': os.getpid(), 'exported': datetime.now(timezone.utc).isoformat(),
+                           'stages': self.to_list()}, indent=indent)
+
+    def export(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            file.write(self.to_json())
+        os.replace(tmp_path, path)
+        return path
+
+
+class _Stage:
+    def __init__(self, diagnostics, name, rows):
+        self.diagnostics = diagnostics
+        self.record = StageRecord(name=name, started='', rows=rows)
+
+    def __enter__(self):
+        stack = self.diagnostics._stack()
+        self.record.parent = stack[-1] if stack else None
+        stack.append(self.record.name)
+        self.record.started = datetime.now(timezone.utc).isoformat()
+        self._memory = rss_mb()
+        self._start = time.perf_counter()
+        return self.record
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.record.seconds = round(time.perf_counter() - self._start, 4)
+        memory = rss_mb()
+        if memory is not None and self._memory is not None:
+            self.record.memory_mb = round(memory - self._memory, 2)
+        if self.record.rows is not None:
+            self.record.rows = int(self.record.rows)
+        if exc_type is not None:
+            self.record.error = f"{exc_type.__name__}: {exc}"
+        self.diagnostics._stack().pop()
+        self.diagnostics.add(self.record)
+        return False
+
+
+# the process wide recorder the app uses
+DIAGNOSTICS = Diagnostics()
+stage = DIAGNOSTICS.stage
+timed = DIAGNOSTICS.timed
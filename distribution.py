@@ -0,0 +1,124 @@
+# Vaccine distribution for AngoVaxTracker
+#
+# Splits a national stock of doses per vaccine over the hospitals, based on
+# the per hospital coverage columns ({vaccine}_Citizen_Count,
+# {vaccine}_Vaccinated_Count, {vaccine}_Not_Vaccinated_Count). A hospital
+# never gets more doses than it has eligible unvaccinated citizens.
+#
+# Two modes:
+#   'coverage'  raise the lowest coverage rates first (water filling): every
+#               dose goes to the hospital whose coverage is lowest at that point
+#   'distance'  minimize the unvaccinated citizens weighted by how far they live
+#               from their hospital; the objective is linear, so filling the
+#               hospitals in order of weight is the optimal (LP) solution
+#
+# Both are vectorized over the hospitals; only the vaccines are looped over.
+
+import numpy as np
+import pandas as pd
+
+MODES = ('coverage', 'distance')
+
+# bisection steps for the water level in allocate_by_coverage
+WATER_LEVEL_STEPS = 60
+
+
+def _integer_doses(doses, need, stock):
+    # round down, then hand the doses lost to rounding to the largest remainders that still have need
+    whole = np.minimum(np.floor(doses + 1e-9), need).astype(np.int64)
+    left = int(min(stock, need.sum()) - whole.sum())
+    if left > 0:
+        remainder = np.where(whole < need, doses - whole, -np.inf)
+        whole[np.argsort(-remainder, kind='stable')[:left]] += 1
+    return whole
+
+
+def allocate_by_coverage(eligible, vaccinated, stock):
+    """Doses per hospital that lift the lowest coverage rates first.
+
+    Finds the coverage level t where giving every hospital
+    min(max(t * eligible - vaccinated, 0), need) doses uses up the stock, so
+    after the allocation no hospital with need left is below t.
+    """
+    eligible = np.asarray(eligible, dtype=np.float64)
+    vaccinated = np.asarray(vaccinated, dtype=np.float64)
+    need = np.maximum(eligible - vaccinated, 0).astype(np.int64)
+    stock = int(stock)
+    if stock >= need.sum():
+        return need
+
+    low, high = 0.0, 1.0
+    for _ in range(WATER_LEVEL_STEPS):
+        level = (low + high) / 2
+        if np.clip(level * eligible - vaccinated, 0, need).sum() > stock:
+            high = level
+        else:
+            low = level
+    return _integer_doses(np.clip(low * eligible - vaccinated, 0, need), need, stock)
+
+
+def allocate_by_priority(need, stock, priority):
+    """Doses per hospital filling the highest priority first (ties: larger need first)."""
+    need = np.maximum(np.asarray(need, dtype=np.int64), 0)
+    order = np.lexsort((-need, -np.asarray(priority, dtype=np.float64)))
+    filled = np.minimum(np.cumsum(need[order]), int(stock))
+    doses = np.empty_like(need)
+    doses[order] = np.diff(filled, prepend=0)
+    return doses
+
+
+def distance_weights(citizens, eligible, status, vaccine_bits, by='Nearest_Hospital'):
+    """Mean distance (km) to their hospital of the eligible unvaccinated citizens, per hospital and vaccine.
+
+    eligible and status are the registry's uint16 bitmasks; hospitals without
+    unvaccinated citizens for a vaccine get 0.
+    """
+    codes, hospitals = pd.factorize(citizens[by])
+    located = codes >= 0
+    distance = np.nan_to_num(citizens['Distance_to_Nearest_Hospital'].to_numpy(dtype=np.float64, na_value=np.nan))
+    missing = np.asarray(eligible, dtype=np.uint16) & ~np.asarray(status, dtype=np.uint16)
+    weights = {}
+    for vaccine, bit in vaccine_bits.items():
+        rows = located & ((missing & bit) != 0)
+        count = np.bincount(codes[rows], minlength=len(hospitals))
+        total = np.bincount(codes[rows], weights=distance[rows], minlength=len(hospitals))
+        weights[vaccine] = np.divide(total, count, out=np.zeros(len(hospitals)), where=count > 0)
+    return pd.DataFrame(weights, index=pd.Index(hospitals, name=by))
+
+
+def distribute(coverage, stock, mode='coverage', weights=None):
+    """Doses per hospital (rows of coverage) and vaccine (keys of stock).
+
+    coverage has the coverage_matrix() columns, stock maps vaccine -> doses.
+    mode 'distance' needs weights, a hospital x vaccine frame like
+    distance_weights(); unvaccinated citizens count (1 + weight) each.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown distribution mode: {mode}")
+    if mode == 'distance' and weights is None:
+        raise ValueError("The 'distance' mode needs distance weights.")
+
+    doses = {}
+    for vaccine, doses_available in stock.items():
+        eligible = coverage[f'{vaccine}_Citizen_Count'].to_numpy()
+        vaccinated = coverage[f'{vaccine}_Vaccinated_Count'].to_numpy()
+        if mode == 'coverage':
+            doses[vaccine] = allocate_by_coverage(eligible, vaccinated, doses_available)
+        else:
+            priority = 1 + weights[vaccine].reindex(coverage.index, fill_value=0).to_numpy()
+            doses[vaccine] = allocate_by_priority(coverage[f'{vaccine}_Not_Vaccinated_Count'].to_numpy(),
+                                                  doses_available, priority)
+    return pd.DataFrame(doses, index=coverage.index, dtype=np.int64)
+
+
+def distribution_summary(coverage, doses):
+    """Per vaccine doses handed out, unvaccinated left and coverage before / after the distribution."""
+    rows = {}
+    for vaccine in doses.columns:
+        eligible = int(coverage[f'{vaccine}_Citizen_Count'].sum())
+        vaccinated = int(coverage[f'{vaccine}_Vaccinated_Count'].sum())
+        given = int(doses[vaccine].sum())
+        rows[vaccine] = {'Doses': given, 'Unvaccinated Left': eligible - vaccinated - given,
+                         'Coverage Before': round(vaccinated / eligible, 4) if eligible else 0.0,
+                         'Coverage After': round((vaccinated + given) / eligible, 4) if eligible else 0.0}
+    return pd.DataFrame.from_dict(rows, orient='index').rename_axis('Vaccine')
@@ -0,0 +1,254 @@
+# Geo helpers for AngoVaxTracker
+#
+# Distances between citizens and health facilities. The scalar haversine() is
+# kept as the reference implementation; the nearest-hospital assignment works
+# on NumPy arrays in chunks so the citizens x hospitals distance matrix never
+# has to fit in memory at once. FacilityIndex keeps the facilities in a k-d tree
+# on the unit sphere for O(log n) nearest and within-radius lookups, and
+# assign_with_capacity() spreads citizens over their k nearest facilities when
+# the nearest one is full. Citizens without finite coordinates get no facility:
+# position -1 and a NaN distance from the lookups, no Nearest_Hospital.
+
+from math import radians, sin, cos, atan2, sqrt # advanced math to calculate distance between coordinates
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_KM = 6371  # Radius of the Earth in kilometers
+
+# upper bound for one block of the distance matrix (float64 values)
+DEFAULT_MAX_BLOCK_BYTES = 64 * 1024 ** 2
+
+# citizens per k-d tree query when assigning through a FacilityIndex
+INDEX_CHUNK_SIZE = 500_000
+
+
+def located(lat, lon):
+    """Mask of the points with finite coordinates."""
+    return np.isfinite(np.asarray(lat, dtype=np.float64)) & np.isfinite(np.asarray(lon, dtype=np.float64))
+
+
+def facility_names(names, position):
+    """Facility names for lookup positions, None where the position is -1 (no coordinates)."""
+    position = np.asarray(position)
+    return np.where(position >= 0, np.asarray(names, dtype=object)[np.maximum(position, 0)], None)
+
+
+# calculate distance between two pairs of coordinates
+def haversine(lat1, lon1, lat2, lon2):
+    R = EARTH_RADIUS_KM
+    dlat = radians(lat2 - lat1)
+    dlon = radians(lon2 - lon1)
+    a = (sin(dlat / 2) ** 2) + cos(radians(lat1)) * cos(radians(lat2)) * (sin(dlon / 2) ** 2)
+    c = 2 * atan2(sqrt(a), sqrt(1 - a))
+    distance = R * c
+    return distance
+
+
+def haversine_np(lat1, lon1, lat2, lon2):
+    """Vectorized haversine in kilometers, inputs in degrees and broadcast like NumPy."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=np.float64)) for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def default_chunk_size(n_hospitals, max_block_bytes=DEFAULT_MAX_BLOCK_BYTES):
+    """Number of citizens per chunk so that one distance block stays under max_block_bytes."""
+    return max(1, int(max_block_bytes // (8 * max(n_hospitals, 1))))
+
+
+def nearest_facility(citizen_lat, citizen_lon, facility_lat, facility_lon, chunk_size=None):
+    """Index of and distance (km) to the nearest facility for every citizen.
+
+    Works through the citizens chunk by chunk, so peak memory is one
+    chunk_size x n_facilities block regardless of how many citizens there are.
+    Citizens without finite coordinates get index -1 and a NaN distance.
+    """
+    citizen_lat = np.asarray(citizen_lat, dtype=np.float64)
+    citizen_lon = np.asarray(citizen_lon, dtype=np.float64)
+    facility_lat = np.radians(np.asarray(facility_lat, dtype=np.float64))
+    facility_lon = np.radians(np.asarray(facility_lon, dtype=np.float64))
+    if len(facility_lat) == 0:
+        raise ValueError("Cannot assign citizens without any facilities.")
+
+    n = len(citizen_lat)
+    chunk_size = chunk_size or default_chunk_size(len(facility_lat))
+    nearest = np.empty(n, dtype=np.int64)
+    distance = np.empty(n, dtype=np.float64)
+    cos_facility_lat = np.cos(facility_lat)
+
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        lat = np.radians(citizen_lat[start:stop])[:, None]
+        lon = np.radians(citizen_lon[start:stop])[:, None]
+        # haversine term only; the distance is monotonic in it, so argmin can skip arcsin
+        a = np.sin((facility_lat - lat) / 2) ** 2 + np.cos(lat) * cos_facility_lat * np.sin((facility_lon - lon) / 2) ** 2
+        best = a.argmin(axis=1)
+        nearest[start:stop] = best
+        best_a = np.clip(a[np.arange(stop - start), best], 0, 1)
+        distance[start:stop] = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(best_a))
+
+    missing = ~located(citizen_lat, citizen_lon)
+    nearest[missing] = -1
+    distance[missing] = np.nan
+    return nearest, distance
+
+
+def to_unit_vectors(lat, lon):
+    """Degrees to (n, 3) points on the unit sphere."""
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+def chord_to_km(chord):
+    # straight-line distance through the sphere -> great-circle distance
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))
+
+
+def km_to_chord(km):
+    return 2 * np.sin(np.minimum(np.asarray(km, dtype=np.float64), np.pi * EARTH_RADIUS_KM) / (2 * EARTH_RADIUS_KM))
+
+
+class FacilityIndex:
+    """Spatial index over a facility table (columns Lat, Long, Facility Name).
+
+    The facilities are stored as 3D unit vectors in a k-d tree: the chord length
+    between two points grows with their great-circle distance, so nearest
+    neighbours on the sphere are nearest neighbours in the tree. Build it once
+    and reuse it for batch assignment and for single-patient registration.
+    """
+
+    def __init__(self, hospitals):
+        self.names = hospitals['Facility Name'].to_numpy()
+        self.lat = hospitals['Lat'].to_numpy(dtype=np.float64)
+        self.long = hospitals['Long'].to_numpy(dtype=np.float64)
+        if len(self.names) == 0:
+            raise ValueError("Cannot build a facility index without any facilities.")
+        self.tree = cKDTree(to_unit_vectors(self.lat, self.long))
+
+    def __len__(self):
+        return len(self.names)
+
+    def nearest(self, lat, lon, k=1):
+        """Positions of and distances (km) to the k nearest facilities for each point.
+
+        Returns arrays of shape (n,) for k=1 and (n, k) otherwise; points without
+        finite coordinates get position -1 and a NaN distance.
+        """
+        k = min(k, len(self))
+        lat, lon = np.atleast_1d(np.asarray(lat, dtype=np.float64)), np.atleast_1d(np.asarray(lon, dtype=np.float64))
+        valid = located(lat, lon)
+        shape = (len(lat),) if k == 1 else (len(lat), k)
+        position = np.full(shape, -1, dtype=np.int64)
+        distance = np.full(shape, np.nan)
+        if valid.any():
+            chord, position[valid] = self.tree.query(to_unit_vectors(lat[valid], lon[valid]), k=k)
+            distance[valid] = chord_to_km(chord)
+        return position, distance
+
+    def nearest_one(self, lat, lon):
+        """(Facility Name, distance in km) of the facility closest to a single point, (None, nan) without coordinates."""
+        position, distance = self.nearest(lat, lon)
+        return facility_names(self.names, position)[0], float(distance[0])
+
+    def within_radius(self, lat, lon, radius_km):
+        """Positions of all facilities within radius_km of a single point, nearest first."""
+        if not located(lat, lon):
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        point = to_unit_vectors([lat], [lon])[0]
+        position = np.asarray(self.tree.query_ball_point(point, km_to_chord(radius_km)), dtype=np.int64)
+        distance = haversine_np(lat, lon, self.lat[position], self.long[position])
+        order = np.argsort(distance)
+        return position[order], distance[order]
+
+
+def assign_nearest_hospital(citizens, hospitals, chunk_size=None, index=None):
+    """Copy of citizens with Nearest_Hospital and Distance_to_Nearest_Hospital filled in.
+
+    With a FacilityIndex the lookup goes through the k-d tree, otherwise through
+    the dense chunked engine (fine for a few hundred facilities).
+    """
+    lat = citizens['Lat'].to_numpy(dtype=np.float64, na_value=np.nan)
+    lon = citizens['Long'].to_numpy(dtype=np.float64, na_value=np.nan)
+    if index is None:
+        nearest, distance = nearest_facility(lat, lon, hospitals['Lat'].to_numpy(), hospitals['Long'].to_numpy(),
+                                             chunk_size=chunk_size)
+    else:
+        nearest = np.empty(len(lat), dtype=np.int64)
+        distance = np.empty(len(lat), dtype=np.float64)
+        chunk_size = chunk_size or INDEX_CHUNK_SIZE
+        for start in range(0, len(lat), chunk_size):
+            stop = start + chunk_size
+            nearest[start:stop], distance[start:stop] = index.nearest(lat[start:stop], lon[start:stop])
+    citizens = citizens.copy()
+    names = index.names if index is not None else hospitals['Facility Name'].to_numpy()
+    citizens['Nearest_Hospital'] = facility_names(names, nearest)
+    citizens['Distance_to_Nearest_Hospital'] = distance
+    return citizens
+
+
+def assign_with_capacity(citizens, hospitals, capacity='Capacity', k=8, max_k=64, index=None, chunk_size=None):
+    """Copy of citizens with Nearest_Hospital, Distance_to_Nearest_Hospital and an Assigned_Facility
+    (with Distance_to_Assigned_Facility) that respects the facilities' capacity column.
+
+    Every citizen proposes to their k nearest facilities in order, one per
+    round; a facility takes the closest proposers of the round while it has
+    room left (missing capacity means unlimited). Each round is a sort of the
+    open proposals, so the cost is about k sorts of the citizens. Citizens
+    still without a facility look further (2k, 4k, ... up to max_k
+    candidates); those who find none keep their nearest facility, which then
+    runs over capacity.
+    """
+    index = index or FacilityIndex(hospitals)
+    citizens = assign_nearest_hospital(citizens, hospitals, chunk_size=chunk_size, index=index)
+    lat = citizens['Lat'].to_numpy(dtype=np.float64, na_value=np.nan)
+    lon = citizens['Long'].to_numpy(dtype=np.float64, na_value=np.nan)
+    n = len(lat)
+    chunk_size = chunk_size or INDEX_CHUNK_SIZE
+
+    if capacity in hospitals:
+        room = hospitals[capacity].to_numpy(dtype=np.float64, na_value=np.nan)
+        room = np.where(np.isnan(room), np.inf, room)
+    else:
+        room = np.full(len(index), np.inf)
+    assigned = np.full(n, -1, dtype=np.int64)
+    assigned_distance = np.full(n, np.nan)
+
+    tried, k = 0, min(k, len(index))
+    # citizens without coordinates have no candidates, they keep Nearest_Hospital (None)
+    has_location = located(lat, lon)
+    open_rows = np.flatnonzero(has_location)
+    while len(open_rows) and tried < k and (room > 0).any():
+        for start in range(0, len(open_rows), chunk_size):
+            rows = open_rows[start:start + chunk_size]
+            position, distance = index.nearest(lat[rows], lon[rows], k=k)
+            candidates, distances = position.reshape(-1, k), distance.reshape(-1, k)
+            for choice in range(tried, k):
+                waiting = assigned[rows] < 0
+                if not waiting.any():
+                    break
+                _accept(rows[waiting], candidates[waiting, choice], distances[waiting, choice],
+                        room, assigned, assigned_distance)
+        open_rows = np.flatnonzero((assigned < 0) & has_location)
+        tried, k = k, min(2 * k, max_k, len(index))
+
+    overflow = assigned < 0
+    names = index.names[np.maximum(assigned, 0)].astype(object)
+    names[overflow] = citizens['Nearest_Hospital'].to_numpy()[overflow]
+    assigned_distance[overflow] = citizens['Distance_to_Nearest_Hospital'].to_numpy()[overflow]
+    citizens['Assigned_Facility'] = names
+    citizens['Distance_to_Assigned_Facility'] = assigned_distance
+    return citizens
+
+
+def _accept(rows, facility, distance, room, assigned, assigned_distance):
+    # one proposal round: closest proposers first within each facility, rank = place in the facility's queue
+    order = np.lexsort((distance, facility))
+    facility_sorted = facility[order]
+    rank = np.arange(len(order)) - np.searchsorted(facility_sorted, facility_sorted, side='left')
+    accepted = rank < room[facility_sorted]
+    assigned[rows[order[accepted]]] = facility_sorted[accepted]
+    assigned_distance[rows[order[accepted]]] = distance[order[accepted]]
+    room -= np.bincount(facility_sorted[accepted], minlength=len(room))
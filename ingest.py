@@ -0,0 +1,162 @@
+# Streaming ingestion of citizen registers
+#
+# Reads a citizen file (xlsx, csv or parquet, local or by URL) chunk by chunk
+# instead of parsing it into memory at once: openpyxl in read-only mode for
+# workbooks, pandas chunks for CSV and row-group batches for Parquet. Every
+# chunk is filtered by country / city, assigned to its nearest hospital and
+# written to a Parquet file before the next one is read, so peak memory is a
+# few chunks however large the register is. Downloads are streamed to disk.
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import requests
+from openpyxl import load_workbook
+
+from data_cache import REQUEST_TIMEOUT, is_url
+from geo import assign_nearest_hospital
+from vaccines import vaccine_abbreviations
+
+CHUNK_SIZE = 50_000  # rows per chunk
+DOWNLOAD_BLOCK = 1024 ** 2  # bytes per streamed download block
+
+# columns with a fixed type, so every chunk has the same Arrow schema
+INTEGER_COLUMNS = ['ID']
+FLOAT_COLUMNS = ['Age', 'Age_Months', 'Lat', 'Long', 'Distance_to_Nearest_Hospital'] + vaccine_abbreviations
+
+
+def download(url, path):
+    """Stream url to path block by block, returns the SHA-256 of the content."""
+    digest = hashlib.sha256()
+    tmp_path = path + '.tmp'
+    with requests.get(url, stream=True, timeout=REQUEST_TIMEOUT) as response:
+        response.raise_for_status()
+        with open(tmp_path, 'wb') as file:
+            for block in response.iter_content(DOWNLOAD_BLOCK):
+                digest.update(block)
+                file.write(block)
+    os.replace(tmp_path, path)
+    return digest.hexdigest()
+
+
+def iter_excel_chunks(path, chunk_size=CHUNK_SIZE):
+    """DataFrames of chunk_size rows from the first sheet of a workbook, read in openpyxl's read-only mode."""
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = [str(column) for column in next(rows, ())]
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield pd.DataFrame(chunk, columns=header)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=header)
+    finally:
+        workbook.close()
+
+
+def iter_csv_chunks(path, chunk_size=CHUNK_SIZE):
+    yield from pd.read_csv(path, chunksize=chunk_size)
+
+
+def iter_parquet_chunks(path, chunk_size=CHUNK_SIZE):
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+        yield batch.to_pandas()
+
+
+readers = {'.xlsx': iter_excel_chunks, '.xlsm': iter_excel_chunks, '.csv': iter_csv_chunks,
+           '.parquet': iter_parquet_chunks}
+
+
+def iter_chunks(source, chunk_size=CHUNK_SIZE, download_dir=None):
+    """Chunks of a citizen file by its extension; URLs are streamed to download_dir (a temp dir by default) first."""
+    extension = os.path.splitext(str(source).split('?')[0])[1].lower()
+    if extension not in readers:
+        raise ValueError(f"Unsupported citizen file type: {source}")
+    if not is_url(source):
+        yield from readers[extension](source, chunk_size)
+        return
+    with tempfile.TemporaryDirectory(dir=download_dir) as directory:
+        path = os.path.join(directory, 'register' + extension)
+        download(source, path)
+        yield from readers[extension](path, chunk_size)
+
+
+def normalize(chunk):
+    """Fixed column types (see INTEGER_COLUMNS / FLOAT_COLUMNS, text otherwise); rows without an ID are dropped."""
+    chunk = chunk.copy()
+    for column in chunk.columns:
+        if column in INTEGER_COLUMNS or column in FLOAT_COLUMNS:
+            chunk[column] = pd.to_numeric(chunk[column], errors='coerce').astype(np.float64)
+        else:
+            # a string dtype even for all-empty columns, so the Arrow type never changes between chunks
+            chunk[column] = chunk[column].astype('string')
+    if 'ID' in chunk:
+        chunk = chunk[chunk['ID'].notna()]
+        chunk['ID'] = chunk['ID'].astype(np.int64)
+    return chunk
+
+
+def filter_chunks(chunks, country=None, city=None, limit=None):
+    """Chunks reduced to one country / city, stopping after limit rows in total."""
+    taken = 0
+    for chunk in chunks:
+        if country is not None and 'Country' in chunk:
+            chunk = chunk[chunk['Country'] == country]
+        if city is not None and 'City' in chunk:
+            chunk = chunk[chunk['City'] == city]
+        if limit is not None:
+            chunk = chunk.head(limit - taken)
+        if len(chunk):
+            taken += len(chunk)
+            yield chunk
+        if limit is not None and taken >= limit:
+            return
+
+
+def assign_chunks(chunks, hospitals, index=None):
+    """Chunks with Nearest_Hospital and Distance_to_Nearest_Hospital, see geo.assign_nearest_hospital."""
+    for chunk in chunks:
+        chunk = assign_nearest_hospital(chunk, hospitals, index=index)
+        # a string dtype even when no citizen of the chunk has coordinates (all None), as in normalize()
+        chunk['Nearest_Hospital'] = chunk['Nearest_Hospital'].astype('string')
+        yield chunk
+
+
+def ingest_citizens(source, hospitals, country=None, city=None, limit=None, index=None, out_path=None,
+                    chunk_size=CHUNK_SIZE):
+    """Stream a citizen file through filtering and geo assignment.
+
+    With out_path every chunk is appended to a Parquet file (one row group per
+    chunk) and the path is returned; otherwise the chunks are concatenated
+    into one frame, which only makes sense for registers that fit in memory.
+    """
+    chunks = assign_chunks(filter_chunks((normalize(chunk) for chunk in iter_chunks(source, chunk_size)),
+                                         country=country, city=city, limit=limit), hospitals, index=index)
+    if out_path is None:
+        frames = list(chunks)
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    tmp_path = out_path + '.tmp'
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema)
+            writer.write_table(table.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        return None
+    os.replace(tmp_path, out_path)
+    return out_path
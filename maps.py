@@ -0,0 +1,229 @@
+# Map layers for AngoVaxTracker
+#
+# Citizens are aggregated server-side into a hexagonal grid before anything is
+# sent to the browser, so a map costs one row per occupied cell instead of one
+# point per citizen. The grid is laid out in kilometres on an equirectangular
+# projection around the data's mean latitude, which is accurate enough at the
+# scale of a country. The hospital map is culled to a bounding box and
+# clusters facilities into screen-sized cells when zoomed out, for the same
+# reason.
+
+import numpy as np
+import pandas as pd
+import pydeck as pdk
+
+from geo import EARTH_RADIUS_KM
+
+SQRT3 = np.sqrt(3)
+
+
+def hex_cells(lat, lon, size_km, origin_lat=None):
+    """Axial (q, r) coordinates of the flat-top hexagon of size_km (centre to corner) each point falls in."""
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    origin_lat = np.nanmean(lat) if origin_lat is None else origin_lat
+    x = EARTH_RADIUS_KM * np.radians(lon) * np.cos(np.radians(origin_lat)) / size_km
+    y = EARTH_RADIUS_KM * np.radians(lat) / size_km
+
+    # fractional cube coordinates, rounded to the nearest hexagon
+    q, r = 2 / 3 * x, -x / 3 + SQRT3 / 3 * y
+    s = -q - r
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq[fix_q] = -rr[fix_q] - rs[fix_q]
+    rr[fix_r] = -rq[fix_r] - rs[fix_r]
+    return rq.astype(np.int64), rr.astype(np.int64)
+
+
+def hex_centres(q, r, size_km, origin_lat):
+    """(lat, lon) in degrees of the centres of axial hexagons."""
+    x = size_km * 1.5 * np.asarray(q, dtype=np.float64)
+    y = size_km * SQRT3 * (np.asarray(r, dtype=np.float64) + np.asarray(q, dtype=np.float64) / 2)
+    lat = np.degrees(y / EARTH_RADIUS_KM)
+    lon = np.degrees(x / (EARTH_RADIUS_KM * np.cos(np.radians(origin_lat))))
+    return lat, lon
+
+
+def hex_coverage(lat, lon, eligible, vaccinated, size_km=5.0):
+    """Per hexagon counts of eligible, vaccinated and unvaccinated citizens.
+
+    eligible and vaccinated are boolean arrays over the same citizens as lat
+    and lon; citizens without coordinates are left out. Returns one row per
+    occupied cell with Lat, Long (the cell centre), Eligible, Vaccinated,
+    Unvaccinated and Coverage Rate, most unvaccinated first.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    located = ~(np.isnan(lat) | np.isnan(lon)) & np.asarray(eligible, dtype=bool)
+    columns = ['Lat', 'Long', 'Eligible', 'Vaccinated', 'Unvaccinated', 'Coverage Rate']
+    if not located.any():
+        return pd.DataFrame(columns=columns)
+
+    lat, lon = lat[located], lon[located]
+    vaccinated = np.asarray(vaccinated, dtype=bool)[located]
+    origin_lat = float(lat.mean())
+    q, r = hex_cells(lat, lon, size_km, origin_lat)
+    # one integer key per cell, so grouping is a 1-d unique instead of a row-wise one
+    width = int(r.max() - r.min()) + 1
+    keys, codes = np.unique((q - q.min()) * width + (r - r.min()), return_inverse=True)
+    cells = np.column_stack((keys // width + q.min(), keys % width + r.min()))
+    eligible_count = np.bincount(codes, minlength=len(cells))
+    vaccinated_count = np.bincount(codes, weights=vaccinated, minlength=len(cells)).astype(np.int64)
+
+    centre_lat, centre_lon = hex_centres(cells[:, 0], cells[:, 1], size_km, origin_lat)
+    frame = pd.DataFrame({'Lat': centre_lat, 'Long': centre_lon, 'Eligible': eligible_count,
+                          'Vaccinated': vaccinated_count, 'Unvaccinated': eligible_count - vaccinated_count,
+                          'Coverage Rate': (vaccinated_count / eligible_count).round(4)}, columns=columns)
+    return frame.sort_values('Unvaccinated', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def coverage_colour(rate):
+    """RGB per coverage rate, red (0) through yellow to green (1)."""
+    rate = np.clip(np.asarray(rate, dtype=np.float64), 0, 1)
+    red = np.where(rate < 0.5, 230, 230 * (1 - rate) * 2)
+    green = np.where(rate < 0.5, 200 * rate * 2, 200)
+    return np.column_stack((red, green, np.full(len(rate), 40))).astype(np.int64).tolist()
+
+
+def hex_column_layer(cells, size_km, elevation_scale=None):
+    """pydeck ColumnLayer drawing hex_coverage() cells as hexagonal columns.
+
+    The height is the number of unvaccinated citizens and the colour the
+    coverage rate; disk_resolution=6 makes the columns hexagons.
+    """
+    cells = cells.assign(Colour=coverage_colour(cells['Coverage Rate']))
+    if elevation_scale is None:
+        # the highest column about as tall as ten cells are wide
+        elevation_scale = 10 * size_km * 1000 / max(int(cells['Unvaccinated'].max()) if len(cells) else 1, 1)
+    return pdk.Layer(
+        'ColumnLayer',
+        data=cells,
+        get_position=['Long', 'Lat'],
+        get_elevation='Unvaccinated',
+        elevation_scale=elevation_scale,
+        radius=size_km * 1000,
+        disk_resolution=6,
+        coverage=0.95,
+        get_fill_color='Colour',
+        extruded=True,
+        pickable=True,
+        auto_highlight=True,
+    )
+
+
+def view_state(lat, lon, zoom=None, pitch=45):
+    """pydeck ViewState centred on the points, zoomed to their extent unless zoom is given."""
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    if zoom is None:
+        extent = max(np.nanmax(lat) - np.nanmin(lat), np.nanmax(lon) - np.nanmin(lon), 0.01) if len(lat) else 10
+        zoom = float(np.clip(np.log2(360 / extent) - 0.5, 1, 15))
+    centre_lat = float(np.nanmean(lat)) if len(lat) else 0.0
+    centre_lon = float(np.nanmean(lon)) if len(lon) else 0.0
+    return pdk.ViewState(latitude=centre_lat, longitude=centre_lon, zoom=zoom, pitch=pitch)
+
+
+# facilities drawn one by one from this zoom level on, below it they are clustered
+DETAIL_ZOOM = 11
+
+# width of a cluster cell in screen pixels
+CLUSTER_PIXELS = 60
+
+
+def bounding_box(lat, lon, margin=0.05):
+    """(min_lat, min_lon, max_lat, max_lon) around the points, widened by margin of its size."""
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    pad_lat = max(np.nanmax(lat) - np.nanmin(lat), 0.01) * margin
+    pad_lon = max(np.nanmax(lon) - np.nanmin(lon), 0.01) * margin
+    return np.nanmin(lat) - pad_lat, np.nanmin(lon) - pad_lon, np.nanmax(lat) + pad_lat, np.nanmax(lon) + pad_lon
+
+
+def in_bounding_box(lat, lon, box):
+    """Boolean mask of the points inside box (min_lat, min_lon, max_lat, max_lon)."""
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    min_lat, min_lon, max_lat, max_lon = box
+    return (lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)
+
+
+def facility_points(hospitals, vaccines):
+    """Facility Name, City, Lat, Long, Citizens, Eligible, Vaccinated and Coverage Rate per facility.
+
+    hospitals is the facility table with the coverage columns joined on (see
+    coverage.join_coverage); Eligible and Vaccinated are summed over vaccines.
+    """
+    eligible = hospitals[[f'{v}_Citizen_Count' for v in vaccines]].to_numpy(dtype=np.int64).sum(axis=1)
+    vaccinated = hospitals[[f'{v}_Vaccinated_Count' for v in vaccines]].to_numpy(dtype=np.int64).sum(axis=1)
+    points = pd.DataFrame({'Facility Name': hospitals['Facility Name'].to_numpy(), 'City': hospitals['City'].to_numpy(),
+                           'Lat': hospitals['Lat'].to_numpy(dtype=np.float64),
+                           'Long': hospitals['Long'].to_numpy(dtype=np.float64),
+                           'Citizens': hospitals['Citizens'].to_numpy(dtype=np.int64),
+                           'Eligible': eligible, 'Vaccinated': vaccinated})
+    points['Coverage Rate'] = np.divide(vaccinated, eligible, out=np.zeros(len(points)), where=eligible > 0).round(4)
+    points['Facilities'] = 1
+    return points.dropna(subset=['Lat', 'Long']).reset_index(drop=True)
+
+
+def cluster_points(points, zoom, cell_pixels=CLUSTER_PIXELS):
+    """Merge facility_points() falling into the same screen-sized grid cell at a zoom level.
+
+    A cell is cell_pixels wide on a 256 pixel web map tile, so clusters grow as
+    the map zooms out. Each cluster sits at the citizen-weighted centre of its
+    facilities and carries their summed counts.
+    """
+    if points.empty:
+        return points
+    cell = cell_pixels * 360 / (256 * 2 ** zoom)
+    row = np.floor(points['Lat'].to_numpy() / cell).astype(np.int64)
+    column = np.floor(points['Long'].to_numpy() / cell).astype(np.int64)
+    codes = pd.factorize(pd.MultiIndex.from_arrays([row, column]))[0]
+    size = codes.max() + 1
+
+    facilities = np.bincount(codes, weights=points['Facilities'], minlength=size).astype(np.int64)
+    weights = points['Citizens'].to_numpy(dtype=np.float64) + 1
+    total_weight = np.bincount(codes, weights=weights, minlength=size)
+    clusters = pd.DataFrame({
+        'Lat': np.bincount(codes, weights=points['Lat'] * weights, minlength=size) / total_weight,
+        'Long': np.bincount(codes, weights=points['Long'] * weights, minlength=size) / total_weight,
+        'Citizens': np.bincount(codes, weights=points['Citizens'], minlength=size).astype(np.int64),
+        'Eligible': np.bincount(codes, weights=points['Eligible'], minlength=size).astype(np.int64),
+        'Vaccinated': np.bincount(codes, weights=points['Vaccinated'], minlength=size).astype(np.int64),
+        'Facilities': facilities,
+    })
+    clusters['Coverage Rate'] = np.divide(clusters['Vaccinated'], clusters['Eligible'], out=np.zeros(size),
+                                          where=clusters['Eligible'] > 0).round(4)
+    # a cluster of one keeps its facility's name
+    first_name = points['Facility Name'].groupby(codes, sort=True).first().to_numpy()
+    clusters.insert(0, 'Facility Name', np.where(facilities == 1, first_name,
+                                                 pd.Series(facilities).astype(str) + ' facilities'))
+    return clusters
+
+
+def map_points(points, box=None, zoom=DETAIL_ZOOM):
+    """The facility points to draw: culled to box, clustered below DETAIL_ZOOM."""
+    if box is not None:
+        points = points[in_bounding_box(points['Lat'], points['Long'], box)]
+    return points.reset_index(drop=True) if zoom >= DETAIL_ZOOM else cluster_points(points, zoom)
+
+
+def facility_layer(points):
+    """pydeck ScatterplotLayer for map_points(): area grows with the citizens, colour is the coverage rate."""
+    points = points.assign(Colour=coverage_colour(points['Coverage Rate']),
+                           Radius=np.sqrt(points['Citizens'].to_numpy(dtype=np.float64) + 1))
+    return pdk.Layer(
+        'ScatterplotLayer',
+        data=points,
+        get_position=['Long', 'Lat'],
+        get_radius='Radius',
+        radius_scale=100,
+        radius_min_pixels=4,
+        radius_max_pixels=40,
+        get_fill_color='Colour',
+        stroked=True,
+        get_line_color=[60, 60, 60],
+        line_width_min_pixels=1,
+        pickable=True,
+    )
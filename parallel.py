@@ -0,0 +1,152 @@
+# Multi-province pipeline for AngoVaxTracker
+#
+# Runs the geo assignment and the coverage aggregation for every province
+# (or any other partition of the citizens) in a process pool. The citizens
+# are sorted by province once and their coordinates, ages and vaccination
+# bitmasks are put in shared memory, so a worker only receives its slice
+# bounds and its province's facilities, never a pickled copy of the citizens.
+# Workers write the assignment into shared output arrays and return the small
+# per hospital count matrix; the results merge into one national table in the
+# coverage_matrix() layout.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from coverage import coverage_columns
+from geo import FacilityIndex, facility_names
+from vaccines import (vaccine_abbreviations, vaccine_age_recommendations_years_int, vaccine_bits, encode_status,
+                      eligibility_status)
+
+
+class SharedArrays:
+    """NumPy arrays in named shared memory blocks; pass .spec to workers and attach() there."""
+
+    def __init__(self, **arrays):
+        self.blocks = {}
+        self.arrays = {}
+        self.spec = {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+            shared[...] = array
+            self.blocks[name] = block
+            self.arrays[name] = shared
+            self.spec[name] = (block.name, array.shape, array.dtype.str)
+
+    @staticmethod
+    def attach(spec):
+        """(blocks, arrays) for a spec in another process; close the blocks when done."""
+        blocks, arrays = {}, {}
+        for name, (block_name, shape, dtype) in spec.items():
+            blocks[name] = shared_memory.SharedMemory(name=block_name)
+            arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=blocks[name].buf)
+        return blocks, arrays
+
+    def close(self):
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _province_task(spec, start, stop, facilities):
+    # worker: assign citizens[start:stop] to the province's facilities and count coverage per facility
+    blocks, arrays = SharedArrays.attach(spec)
+    try:
+        index = FacilityIndex(facilities)
+        position, distance = index.nearest(arrays['lat'][start:stop], arrays['long'][start:stop])
+        arrays['nearest'][start:stop] = position
+        arrays['distance'][start:stop] = distance
+
+        # citizens without coordinates (position -1) are not counted at any facility
+        found = position >= 0
+        position = position[found]
+        bits = np.array([vaccine_bits[vaccine] for vaccine in vaccine_abbreviations], dtype=np.uint16)
+        eligible = (arrays['eligible'][start:stop][found, None] & bits) != 0
+        vaccinated = eligible & ((arrays['status'][start:stop][found, None] & bits) != 0)
+        size = len(index)
+        counts = np.column_stack([np.bincount(position, minlength=size)]
+                                 + [np.bincount(position, weights=eligible[:, j], minlength=size) for j in range(len(bits))]
+                                 + [np.bincount(position, weights=vaccinated[:, j], minlength=size) for j in range(len(bits))])
+        return counts.astype(np.int64)
+    finally:
+        del arrays
+        for block in blocks.values():
+            block.close()
+
+
+def national_coverage(citizens, hospitals, by='City', workers=None):
+    """Geo assignment and coverage of all partitions (provinces) of the citizens in a process pool.
+
+    Citizens are matched to the facilities with the same value of by; those in
+    a partition without facilities are matched against all facilities.
+    Returns (citizens with Nearest_Hospital and Distance_to_Nearest_Hospital,
+    coverage frame in the coverage_matrix() layout indexed by facility name).
+    """
+    hospitals = hospitals.reset_index(drop=True)
+    if len(hospitals) == 0:
+        raise ValueError("Cannot assign citizens without any facilities.")
+    workers = workers or os.cpu_count() or 1
+
+    # citizens sorted by partition so every partition is one contiguous slice
+    codes, partitions = pd.factorize(citizens[by], use_na_sentinel=False)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(partitions) + 1))
+    ages = citizens['Age'].to_numpy(dtype=np.float64, na_value=np.nan)[order]
+
+    # facilities grouped the same way, each group's rows are offsets into the facility table
+    facility_groups = hospitals.groupby(by, sort=False).indices if by in hospitals else {}
+    all_facilities = np.arange(len(hospitals))
+
+    counts = np.zeros((len(hospitals), 1 + 2 * len(vaccine_abbreviations)), dtype=np.int64)
+    with SharedArrays(lat=citizens['Lat'].to_numpy(dtype=np.float64, na_value=np.nan)[order],
+                      long=citizens['Long'].to_numpy(dtype=np.float64, na_value=np.nan)[order],
+                      status=encode_status(citizens)[order], eligible=eligibility_status(ages),
+                      nearest=np.zeros(len(citizens), dtype=np.int64),
+                      distance=np.zeros(len(citizens), dtype=np.float64)) as shared:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = []
+            for i, partition in enumerate(partitions):
+                rows = facility_groups.get(partition, all_facilities)
+                futures.append((rows, pool.submit(_province_task, shared.spec, int(bounds[i]), int(bounds[i + 1]),
+                                                  hospitals.iloc[rows])))
+            for rows, future in futures:
+                np.add.at(counts, rows, future.result())
+            nearest_sorted = shared.arrays['nearest'].copy()
+            distance_sorted = shared.arrays['distance'].copy()
+        # workers return positions within their partition's facilities, map them to facility table rows
+        for i, partition in enumerate(partitions):
+            rows = facility_groups.get(partition, all_facilities)
+            part = nearest_sorted[bounds[i]:bounds[i + 1]]
+            nearest_sorted[bounds[i]:bounds[i + 1]] = np.where(part >= 0, np.asarray(rows)[np.maximum(part, 0)], -1)
+
+    nearest = np.empty_like(nearest_sorted)
+    distance = np.empty_like(distance_sorted)
+    nearest[order] = nearest_sorted
+    distance[order] = distance_sorted
+    citizens = citizens.copy()
+    citizens['Nearest_Hospital'] = facility_names(hospitals['Facility Name'].to_numpy(), nearest)
+    citizens['Distance_to_Nearest_Hospital'] = distance
+
+    v = len(vaccine_abbreviations)
+    coverage = pd.DataFrame({'Citizens': counts[:, 0]}, index=pd.Index(hospitals['Facility Name'], name='Nearest_Hospital'))
+    for j, vaccine in enumerate(vaccine_abbreviations):
+        coverage[f'{vaccine}_Citizen_Count'] = counts[:, 1 + j]
+        coverage[f'{vaccine}_Vaccinated_Count'] = counts[:, 1 + v + j]
+        coverage[f'{vaccine}_Not_Vaccinated_Count'] = counts[:, 1 + j] - counts[:, 1 + v + j]
+    # facilities with the same name in several rows are one hospital, as in coverage_matrix()
+    coverage = coverage.groupby(level=0, sort=False).sum()
+    # vaccines in the order coverage_matrix() puts them, its age ranges' order
+    return citizens, coverage[coverage_columns(vaccine_age_recommendations_years_int)]
@@ -0,0 +1,394 @@
+# Patients for AngoVaxTracker
+#
+# Making a class that enables a few different functions
+#
+# * You can input data frames that then are converted to the class so that all the class functions can be used on the data frame
+# * You can also add patient, update vaccine status -> this will modify the registry's citizen table
+# * Functions like, summary etc to get vaccination status and patient info
+#
+# The PatientRegistry is a columnar store: the citizen table itself, one
+# uint16 vaccination bitmask per citizen and a hash index from ID to row.
+# Registrations are staged in a write buffer and appended in batches (one
+# concat per batch instead of one copy of the table per patient).
+# Patient objects are not kept per citizen; find() and the hospital / city /
+# country lookups hand out small __slots__ views (registry, row) that read
+# from the table. Hello.py keeps one registry per server
+# (st.cache_resource), so it survives reruns and is shared by all sessions;
+# listeners registered in on_update get every add or vaccine status update, so
+# derived tables (coverage.CoverageView) are adjusted instead of recomputed.
+# Writes take the registry's lock and, with a store (store.py), are written
+# through to SQLite.
+
+import threading
+from functools import wraps
+
+import numpy as np
+import pandas as pd
+
+from coverage import PLACE_COLUMNS
+from geo import assign_nearest_hospital
+from vaccines import (vaccine_abbreviations, vaccine_dictionary, vaccine_bits, all_vaccines_mask,
+                      status_bits, encode_status, eligibility_status, decode_status)
+
+# ask for the hospital of the worker
+my_hospital = 'Hospital Provincial de Bengo'
+
+
+def _serialized(method):
+  # registry writes run one at a time, the registry is shared by all sessions
+  @wraps(method)
+  def locked(self, *args, **kwargs):
+    with self.lock:
+      return method(self, *args, **kwargs)
+  return locked
+
+
+class PatientRegistry:
+  # new registrations are staged and appended to the table in batches of this size
+  batch_size = 1000
+
+  def __init__(self, citizens, hospitals, index=None, store=None):
+    self._citizens = citizens.reset_index(drop=True)
+    for vaccine in vaccine_abbreviations:
+      if vaccine not in self._citizens:
+        self._citizens[vaccine] = 0
+    self.hospitals = hospitals
+    self.index = index
+    # registrations and status updates are written through to the store (store.Store) if there is one
+    self.store = store
+    self.lock = threading.RLock()
+    # on_update: listener(places, eligible, old_status, new_status) for the affected citizens: a frame with their
+    #            Country, City and Nearest_Hospital and their bitmask arrays, old_status is None for newly added
+    #            citizens (see coverage.CoverageView.apply)
+    self.on_update = []
+    # Facility Name -> (City, Country) for registrations
+    self._hospital_places = dict(zip(hospitals['Facility Name'], zip(hospitals['City'], hospitals['Country'])))
+
+    # vaccination status of every citizen as a bitmask over vaccine_abbreviations,
+    # and the same for the vaccines their age makes them eligible for
+    self._status = encode_status(self._citizens)
+    self._eligible = eligibility_status(self._citizens['Age'].to_numpy(dtype=np.float64, na_value=np.nan))
+    self._reindex()
+
+    # write buffer: rows registered since the last flush, ID -> row for them and their bitmasks, so
+    # patients that were just registered can be read and vaccinated without flushing the buffer
+    self._pending = []
+    self._pending_rows = {}
+    self._pending_status = []
+    self._pending_eligible = []
+
+  def _reindex(self):
+    # hash index ID -> row (first row wins if an ID appears twice in the source file)
+    ids = self._citizens['ID']
+    first = ~ids.duplicated().to_numpy()
+    self.id_index = pd.Index(ids.to_numpy()[first])
+    self.id_rows = np.flatnonzero(first)
+    # secondary indexes (column -> {value: rows}), built on first use
+    self._groups = {}
+
+  # reading the table, the status or the eligibility flushes the write buffer first
+  @property
+  def citizens(self):
+    self.flush()
+    return self._citizens
+
+  @property
+  def status(self):
+    self.flush()
+    return self._status
+
+  @property
+  def eligible(self):
+    self.flush()
+    return self._eligible
+
+  @_serialized
+  def flush(self):
+    """Append the staged registrations to the citizen table in one concat."""
+    if not self._pending:
+      return
+    new_rows = pd.DataFrame(self._pending)
+    self._pending = []
+    self._pending_rows = {}
+    self._pending_status = []
+    self._pending_eligible = []
+    self._append(new_rows)
+
+  def _append(self, new_rows):
+    # new_rows must have IDs that are unique and not registered yet
+    first_row = len(self._citizens)
+    self._citizens = pd.concat([self._citizens, new_rows], ignore_index=True)
+    self._status = np.concatenate([self._status, encode_status(new_rows)])
+    self._eligible = np.concatenate([self._eligible,
+                                     eligibility_status(new_rows['Age'].to_numpy(dtype=np.float64, na_value=np.nan))])
+    self.id_index = self.id_index.append(pd.Index(new_rows['ID'].to_numpy()))
+    self.id_rows = np.concatenate([self.id_rows, np.arange(first_row, first_row + len(new_rows))])
+    self._groups = {}
+
+  def __len__(self):
+    return len(self.id_index) + len(self._pending)
+
+  def _pending_position(self, row):
+    # position of a row in the write buffer, None if it is in the table already
+    position = row - len(self._citizens)
+    return position if 0 <= position < len(self._pending) else None
+
+  # single row reads, served from the write buffer for staged rows instead of flushing it
+  @_serialized
+  def value(self, row, column):
+    """One cell of the citizen table."""
+    position = self._pending_position(row)
+    if position is not None:
+      return self._pending[position][column]
+    return self._citizens[column].iat[row]
+
+  @_serialized
+  def status_at(self, row):
+    """Vaccination bitmask of one row."""
+    position = self._pending_position(row)
+    return int(self._pending_status[position] if position is not None else self._status[row])
+
+  @_serialized
+  def eligible_at(self, row):
+    """Eligibility bitmask of one row."""
+    position = self._pending_position(row)
+    return int(self._pending_eligible[position] if position is not None else self._eligible[row])
+
+  def __contains__(self, ID):
+    return self.row(ID) is not None
+
+  def row(self, ID):
+    """Row of a patient in the citizen table, None if the ID is unknown."""
+    if ID in self._pending_rows:
+      return self._pending_rows[ID]
+    try:
+      position = self.id_index.get_loc(ID)
+    except (KeyError, TypeError):
+      return None
+    return int(self.id_rows[position])
+
+  def rows_by(self, column, value):
+    """Rows of the citizens with the given value in column (e.g. Nearest_Hospital, City, Country)."""
+    citizens = self.citizens
+    if column not in self._groups:
+      self._groups[column] = citizens.groupby(column, sort=False).indices
+    return self._groups[column].get(value, np.empty(0, dtype=np.int64))
+
+  @_serialized
+  def register(self, ID, age, gender, hospital, lat=None, long=None):
+    """Stage a new citizen for the table, returns the row it will have."""
+    # duplicate IDs would make the index ambiguous
+    if ID in self:
+      raise ValueError(f"Patient with ID {ID} is already registered.")
+
+    distance = np.nan
+    # without (finite) coordinates the patient stays at the given hospital
+    if lat is not None and long is not None and np.isfinite(lat) and np.isfinite(long):
+      hospital, distance = self.index.nearest_one(lat, long)
+
+    # Access DataFrame to get additional information (to have less input work from health worker)
+    if hospital not in self._hospital_places:
+      raise ValueError(f"Unknown hospital: {hospital}")
+    city, country = self._hospital_places[hospital]
+    new_patient_info = {'ID': ID, 'Age': age, 'Gender': gender, 'City': city, 'Country': country,
+                        'Lat': np.nan if lat is None else lat, 'Long': np.nan if long is None else long,
+                        'Nearest_Hospital': hospital, 'Distance_to_Nearest_Hospital': distance}
+    new_patient_info.update({vaccine: 0 for vaccine in vaccine_abbreviations})
+
+    if self.store is not None:
+      self.store.add_citizen(new_patient_info)
+    eligible = eligibility_status([age])
+    row = len(self._citizens) + len(self._pending)
+    self._pending.append(new_patient_info)
+    self._pending_rows[ID] = row
+    self._pending_status.append(0)
+    self._pending_eligible.append(int(eligible[0]))
+    if len(self._pending) >= self.batch_size:
+      self.flush()
+    self.changed(pd.DataFrame({'Country': [country], 'City': [city], 'Nearest_Hospital': [hospital]}),
+                 eligible, None, np.zeros(1, dtype=np.uint16))
+    return row
+
+  @_serialized
+  def add_citizens(self, citizens):
+    """Bulk import of a citizen table, returns the IDs that were skipped as duplicates.
+
+    Needs ID and Age; citizens with Lat/Long but no Nearest_Hospital are assigned
+    with the facility index, City and Country default to those of the hospital
+    and missing vaccine columns count as not vaccinated.
+    """
+    self.flush()
+    citizens = citizens.reset_index(drop=True)
+    duplicate = citizens['ID'].duplicated() | citizens['ID'].isin(self.id_index)
+    skipped = citizens.loc[duplicate, 'ID'].tolist()
+    citizens = citizens[~duplicate.to_numpy()]
+    if citizens.empty:
+      return skipped
+
+    if 'Nearest_Hospital' not in citizens and self.index is not None:
+      citizens = assign_nearest_hospital(citizens, self.hospitals, index=self.index)
+    hospital_info = self.hospitals.set_index('Facility Name')
+    for column in ('City', 'Country'):
+      from_hospital = citizens['Nearest_Hospital'].map(hospital_info[column])
+      citizens[column] = citizens[column].fillna(from_hospital) if column in citizens else from_hospital
+    for vaccine in vaccine_abbreviations:
+      citizens[vaccine] = citizens[vaccine].fillna(0) if vaccine in citizens else 0
+
+    first_row = len(self._citizens)
+    self._append(citizens)
+    if self.store is not None:
+      self.store.add_citizens(citizens, self._status[first_row:])
+    self.changed(citizens[PLACE_COLUMNS], self._eligible[first_row:], None, self._status[first_row:])
+    return skipped
+
+  @_serialized
+  def update_status(self, row, mask):
+    """Store a new vaccination bitmask for one citizen and write its changed vaccine columns.
+
+    Rows still in the write buffer are updated there, the buffer is not flushed.
+    """
+    old_mask = self.status_at(row)
+    ID = self.value(row, 'ID')
+    if self.store is not None:
+      self.store.record_status(ID, old_mask, mask)
+    changed_vaccines = decode_status(old_mask ^ int(mask))
+    position = self._pending_position(row)
+    if position is not None:
+      self._pending_status[position] = int(mask)
+      for vaccine in changed_vaccines:
+        self._pending[position][vaccine] = int(bool(mask & vaccine_bits[vaccine]))
+    else:
+      self._status[row] = mask
+      # one cell per changed vaccine (.iloc with a column list copies whole columns on pandas 3)
+      for vaccine in changed_vaccines:
+        self._citizens.iat[row, self._citizens.columns.get_loc(vaccine)] = int(bool(mask & vaccine_bits[vaccine]))
+    self.changed(pd.DataFrame({column: [self.value(row, column)] for column in PLACE_COLUMNS}),
+                 np.array([self.eligible_at(row)], dtype=np.uint16),
+                 np.array([old_mask], dtype=np.uint16), np.array([mask], dtype=np.uint16))
+
+  def changed(self, places, eligible, old_status, new_status):
+    for listener in self.on_update:
+      listener(places, eligible, old_status, new_status)
+
+  def missing_rows(self, vaccines, hospital=None, city=None, country=None, eligible_only=True):
+    """Rows of the citizens that lack at least one of the given vaccines.
+
+    With eligible_only only vaccines the citizen's age qualifies for count, e.g.
+    missing_rows('MMR', hospital=...) are the citizens there who are due for MMR.
+    The filters are bitwise operations on the status arrays, no Python loop per citizen.
+    """
+    rows = None
+    for column, value in (('Nearest_Hospital', hospital), ('City', city), ('Country', country)):
+      if value is not None:
+        selected = self.rows_by(column, value)
+        rows = selected if rows is None else np.intersect1d(rows, selected, assume_unique=True)
+
+    status = self.status if rows is None else self.status[rows]
+    due = ~status & np.uint16(status_bits(vaccines))
+    if eligible_only:
+      due &= self.eligible if rows is None else self.eligible[rows]
+    hits = np.flatnonzero(due)
+    return hits if rows is None else rows[hits]
+
+  def missing_ids(self, vaccines, hospital=None, city=None, country=None, eligible_only=True):
+    """IDs of the citizens returned by missing_rows()."""
+    rows = self.missing_rows(vaccines, hospital=hospital, city=city, country=country, eligible_only=eligible_only)
+    return self.citizens['ID'].to_numpy()[rows]
+
+  # Function to find a patient by ID
+  def find(self, target_id:int):
+    row = self.row(target_id)
+    return None if row is None else Patient.view(self, row)  # None if no patient with the specified ID is found
+
+  def patients_at_hospital(self, hospital):
+    return [Patient.view(self, row) for row in self.rows_by('Nearest_Hospital', hospital)]
+
+  def patients_in_city(self, city):
+    return [Patient.view(self, row) for row in self.rows_by('City', city)]
+
+  def patients_in_country(self, country):
+    return [Patient.view(self, row) for row in self.rows_by('Country', country)]
+
+
+def _column(name):
+  return property(lambda self: self.registry.value(self.row, name))
+
+
+# making a class, a Patient is a view on one row of the registry
+class Patient:
+  __slots__ = ('registry', 'row')
+
+  # Possible vaccines
+  possible_vaccines = [v.upper() for v in vaccine_abbreviations]
+
+  # Vaccine dictionary
+  vaccine_description = vaccine_dictionary
+
+  # upper case name -> bit in the status bitmask
+  _bits = {vaccine.upper(): bit for vaccine, bit in vaccine_bits.items()}
+
+  ID = _column('ID')
+  age = _column('Age')
+  gender = _column('Gender')
+  city = _column('City')
+  country = _column('Country')
+  lat = _column('Lat')
+  long = _column('Long')
+  hospital = _column('Nearest_Hospital')
+  distance_to_hospital = _column('Distance_to_Nearest_Hospital')
+
+  # default input, registers a new patient
+  # with lat/long the patient is assigned to the nearest hospital instead of the given one
+  def __init__(self, ID, age, gender, hospital=my_hospital, lat=None, long=None, registry=None):
+    if registry is None:
+      raise TypeError("Patient needs the PatientRegistry to register the patient in (registry=...).")
+    self.registry = registry
+    self.row = registry.register(ID, age, gender, hospital, lat=lat, long=long)
+
+  @classmethod
+  def view(cls, registry, row):
+    # a Patient for an existing row, nothing is registered
+    patient = object.__new__(cls)
+    patient.registry = registry
+    patient.row = row
+    return patient
+
+  @property
+  def vaccine_status(self):
+    mask = self.registry.status_at(self.row)
+    return {vaccine.upper(): bool(mask & bit) for vaccine, bit in vaccine_bits.items()}
+
+  def get_vaccines_list(self):
+    return self.vaccine_description
+
+  def input_vaccination_status(self, **kwargs):
+    mask = self.registry.status_at(self.row)
+    expected_vaccines = all_vaccines_mask & ~mask
+
+    for vaccine_name, status in kwargs.items():
+      bit = self._bits.get(vaccine_name.upper(), 0)
+      if bit & expected_vaccines:
+        mask = mask | bit if status else mask & ~bit
+      else:
+        print(f"Ignoring unknown vaccine: {vaccine_name}")
+
+    # Update vaccination status in the citizen table
+    self.registry.update_status(self.row, mask)
+
+  # get the vaccines the child has taken
+  def get_true_vaccines(self):
+    return [vaccine.upper() for vaccine in decode_status(self.registry.status_at(self.row))]
+
+  # get the vaccines the child misses (the complement of the bitmask, one pass)
+  def get_not_true_vaccines(self):
+    return [vaccine.upper() for vaccine in decode_status(all_vaccines_mask & ~self.registry.status_at(self.row))]
+
+  # get the missing vaccines the child is old enough / young enough for
+  def get_due_vaccines(self):
+    return [vaccine.upper() for vaccine in decode_status(self.registry.eligible_at(self.row) & ~self.registry.status_at(self.row))]
+
+  def report(self):
+    return f'Patient with ID {self.ID} has birth gender {self.gender}. This patient has age {self.age} and lives in {self.city}.\nThe patient has at current time taken these vaccines: {self.get_true_vaccines()}\nVaccines that are missing: {self.get_not_true_vaccines()}'
+
+  def summary(self):
+    print(self.report())
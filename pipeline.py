@@ -0,0 +1,199 @@
+# Data pipeline for AngoVaxTracker
+#
+# The stages the app runs before it can show anything, as plain functions so
+# they can be cached by Streamlit (see Hello.py) or run on their own:
+#
+#   raw load -> geo assignment -> coverage matrix -> patient registry
+#
+# The batch run (cli.py) executes the first three stages without Streamlit and
+# exports the results to BATCH_DIR; the app loads them from there when present.
+
+import json
+import os
+import shutil
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from coverage import coverage_matrix, join_coverage
+from data_cache import CACHE_DIR, cached_sha256, load_register
+from geo import FacilityIndex, assign_nearest_hospital, assign_with_capacity
+from ingest import ingest_citizens, iter_parquet_chunks
+from parallel import national_coverage
+
+# URLs of the Excel files on GitHub (raw file URLs)
+CITIZENS_URL = "https://github.com/marikolk/Vaccination/raw/main/citizens_angola_Bengo.xlsx"
+FACILITIES_URL = "https://github.com/marikolk/Vaccination/raw/main/subset_sub-saharan_health_facilities_edited.xlsx"
+
+# where the batch run writes its outputs
+BATCH_DIR = os.environ.get('ANGOVAX_BATCH_DIR', os.path.join(CACHE_DIR, 'batch'))
+# the outputs of a batch run that load_batch() reads
+BATCH_FILES = ('citizens.parquet', 'hospitals.parquet')
+
+
+def load_registers(citizens_source=CITIZENS_URL, facilities_source=FACILITIES_URL,
+                   country='Angola', city='Bengo', limit=None):
+    """Raw load: (citizens, hospitals) subsets to work with."""
+    citizens = load_register(citizens_source)
+    hospitals = load_register(facilities_source)
+
+    # subsets to work with, citizens filtered the same way as in ingest.filter_chunks()
+    hospitals_subset = hospitals[(hospitals['Country'] == country) & (hospitals['City'] == city)].reset_index(drop=True)
+    if 'Country' in citizens:
+        citizens = citizens[citizens['Country'] == country]
+    if 'City' in citizens:
+        citizens = citizens[citizens['City'] == city]
+    citizens_subset = (citizens.head(limit) if limit else citizens).reset_index(drop=True)
+    return citizens_subset, hospitals_subset
+
+
+def registers_version(citizens_source=CITIZENS_URL, facilities_source=FACILITIES_URL):
+    """Version of the registers load_registers() last read: their content hashes, None if one is not cached."""
+    digests = [cached_sha256(source) for source in (citizens_source, facilities_source)]
+    return None if None in digests else ':'.join(digests)
+
+
+def stream_registers(citizens_source, facilities_source=FACILITIES_URL, country='Angola', city='Bengo', limit=None,
+                     out_path=None):
+    """Raw load and geo assignment in one streamed pass over the citizen file.
+
+    For national registers that do not fit in memory: the citizens are read,
+    filtered and assigned chunk by chunk (see ingest.py). Returns (citizens,
+    hospitals), where citizens is the out_path Parquet file if one is given.
+    """
+    hospitals = load_register(facilities_source)
+    hospitals_subset = hospitals[(hospitals['Country'] == country) & (hospitals['City'] == city)].reset_index(drop=True)
+    citizens = ingest_citizens(citizens_source, hospitals_subset, country=country, city=city, limit=limit,
+                               index=build_facility_index(hospitals_subset), out_path=out_path)
+    if citizens is None or (isinstance(citizens, pd.DataFrame) and citizens.empty):
+        raise ValueError(f"No citizens of {city}, {country} in {citizens_source}.")
+    return citizens, hospitals_subset
+
+
+def build_facility_index(hospitals):
+    return FacilityIndex(hospitals)
+
+
+def geo_assignment(citizens, hospitals, index=None, capacity=None):
+    """Geo assignment: citizens with Nearest_Hospital and Distance_to_Nearest_Hospital.
+
+    With capacity (the name of a facility capacity column) the citizens also get
+    an Assigned_Facility that keeps every facility within its capacity.
+    """
+    if capacity is not None:
+        return assign_with_capacity(citizens, hospitals, capacity=capacity, index=index)
+    return assign_nearest_hospital(citizens, hospitals, index=index)
+
+
+def hospital_coverage(citizens, hospitals):
+    """Coverage matrix: hospitals with Citizens and the per vaccine coverage counts."""
+    return join_coverage(hospitals, coverage_matrix(citizens))
+
+
+def streamed_coverage(citizens_path, hospitals):
+    """hospital_coverage() of a citizen Parquet file (stream_registers' out_path), read one row group at a time."""
+    coverage = None
+    for chunk in iter_parquet_chunks(citizens_path):
+        counts = coverage_matrix(chunk)
+        coverage = counts if coverage is None else pd.concat([coverage, counts]).groupby(level=0, sort=False).sum()
+    return join_coverage(hospitals, coverage)
+
+
+def national_registers(citizens_source=CITIZENS_URL, facilities_source=FACILITIES_URL, country='Angola', by='City',
+                       workers=None):
+    """Geo assignment and coverage of every province of a country at once, one province per worker process.
+
+    Returns (citizens with their nearest hospital, hospitals with the coverage counts joined on).
+    """
+    citizens = load_register(citizens_source)
+    hospitals = load_register(facilities_source)
+    if 'Country' in citizens:
+        citizens = citizens[citizens['Country'] == country]
+    hospitals = hospitals[hospitals['Country'] == country].reset_index(drop=True)
+    citizens, coverage = national_coverage(citizens, hospitals, by=by, workers=workers)
+    return citizens, join_coverage(hospitals, coverage)
+
+
+def export_batch(citizens, hospitals, output_dir=BATCH_DIR, formats=('parquet',), manifest=None):
+    """Write the assigned citizens and the hospitals with their coverage, plus a manifest.json.
+
+    citizens is a frame or a Parquet file (stream_registers' out_path), which
+    is moved into place and copied to CSV chunk by chunk. Parquet files are
+    always written, they are what load_batch() reads; 'csv' adds CSV copies
+    for use outside the app. Outputs of an earlier run in a format not written
+    now are removed. Returns the paths written.
+    """
+    unknown = set(formats) - {'parquet', 'csv'}
+    if unknown:
+        raise ValueError(f"Unknown output format: {', '.join(sorted(unknown))}")
+    formats = ['parquet'] + [file_format for file_format in ('csv',) if file_format in formats]
+    citizen_count = len(citizens) if isinstance(citizens, pd.DataFrame) else pq.ParquetFile(citizens).metadata.num_rows
+    os.makedirs(output_dir, exist_ok=True)
+    # without a manifest load_batch() ignores the directory, so it never reads old and new files together
+    manifest_path = os.path.join(output_dir, 'manifest.json')
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    paths = []
+    for name, frame in (('citizens', citizens), ('hospitals', hospitals)):
+        for file_format in ('parquet', 'csv'):
+            path = os.path.join(output_dir, f'{name}.{file_format}')
+            if file_format not in formats:
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+            tmp_path = path + '.tmp'
+            if not isinstance(frame, pd.DataFrame):
+                _write_streamed(frame, tmp_path, file_format)
+            elif file_format == 'parquet':
+                frame.to_parquet(tmp_path, index=False)
+            else:
+                frame.to_csv(tmp_path, index=False)
+            os.replace(tmp_path, path)
+            paths.append(path)
+            if not isinstance(frame, pd.DataFrame):
+                # the streamed file is now the Parquet output, the CSV copy is read from there
+                frame = path
+    # written last, so a manifest means the files it lists are complete
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump({**(manifest or {}), 'citizens': citizen_count, 'hospitals': len(hospitals),
+                   'files': [os.path.basename(path) for path in paths]}, file, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return paths + [manifest_path]
+
+
+def _write_streamed(source, path, file_format):
+    # a Parquet file as an output: moved for parquet, copied to CSV one row group at a time
+    if file_format == 'parquet':
+        shutil.move(source, path)
+        return
+    header = True
+    for chunk in iter_parquet_chunks(source):
+        chunk.to_csv(path, index=False, header=header, mode='w' if header else 'a')
+        header = False
+
+
+def _batch_manifest(output_dir):
+    # the manifest of the last batch run, None if there is none or it does not list the Parquet outputs
+    try:
+        with open(os.path.join(output_dir, 'manifest.json'), encoding='utf-8') as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        return None
+    files = manifest.get('files', [])
+    if not all(name in files and os.path.exists(os.path.join(output_dir, name)) for name in BATCH_FILES):
+        return None
+    return manifest
+
+
+def batch_version(output_dir=BATCH_DIR):
+    """Version of the last batch run (its manifest's mtime in ns), None if there is none."""
+    if _batch_manifest(output_dir) is None:
+        return None
+    return os.stat(os.path.join(output_dir, 'manifest.json')).st_mtime_ns
+
+
+def load_batch(output_dir=BATCH_DIR):
+    """(citizens, hospitals) exported by the last batch run, None if there is none."""
+    if _batch_manifest(output_dir) is None:
+        return None
+    return tuple(pd.read_parquet(os.path.join(output_dir, name)) for name in BATCH_FILES)
@@ -0,0 +1,227 @@
+# Persistent store for AngoVaxTracker
+#
+# The citizen register, the facilities and every vaccination status change are
+# kept in one SQLite database so registrations and vaccinations survive a
+# restart of the app. The database runs in WAL mode: readers never block the
+# writer or each other, so every thread (Streamlit session) gets its own
+# connection, and all writes go through one lock so there is a single writer
+# at a time.
+#
+# A citizen's vaccination status is stored as the same uint16 bitmask the
+# PatientRegistry uses (see vaccines.py); the vaccination_events table is an
+# append-only log of (ID, old status, new status) changes. The meta table holds
+# bookkeeping such as the version of the batch run (pipeline.BATCH_DIR) or of
+# the source registers the citizens were last merged from.
+
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from data_cache import CACHE_DIR
+from vaccines import encode_status, vaccine_bits
+
+STORE_PATH = os.environ.get('ANGOVAX_DB', os.path.join(CACHE_DIR, 'angovax.db'))
+
+# seconds a connection waits for a lock held by another process before giving up
+BUSY_TIMEOUT = 30
+
+# citizen table columns kept in the store, besides the status bitmask
+CITIZEN_COLUMNS = ['ID', 'Age', 'Gender', 'City', 'Country', 'Lat', 'Long',
+                   'Nearest_Hospital', 'Distance_to_Nearest_Hospital']
+FACILITY_COLUMNS = ['Facility Name', 'City', 'Country', 'Lat', 'Long']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS citizens (
+    ID INTEGER PRIMARY KEY,
+    Age NUMERIC,
+    Gender TEXT,
+    City TEXT,
+    Country TEXT,
+    Lat REAL,
+    Long REAL,
+    Nearest_Hospital TEXT,
+    Distance_to_Nearest_Hospital REAL,
+    Status INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS citizens_hospital ON citizens (Nearest_Hospital);
+CREATE INDEX IF NOT EXISTS citizens_city ON citizens (Country, City);
+
+CREATE TABLE IF NOT EXISTS facilities (
+    "Facility Name" TEXT PRIMARY KEY,
+    City TEXT,
+    Country TEXT,
+    Lat REAL,
+    Long REAL
+);
+
+CREATE TABLE IF NOT EXISTS vaccination_events (
+    Event INTEGER PRIMARY KEY AUTOINCREMENT,
+    ID INTEGER NOT NULL,
+    Old_Status INTEGER NOT NULL,
+    New_Status INTEGER NOT NULL,
+    Recorded_At TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS vaccination_events_id ON vaccination_events (ID);
+
+CREATE TABLE IF NOT EXISTS meta (
+    Key TEXT PRIMARY KEY,
+    Value TEXT
+);
+'''
+
+
+def _value(value):
+    # NumPy scalars and missing values -> what sqlite3 can bind
+    if value is None or (isinstance(value, float) and np.isnan(value)) or value is pd.NA:
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class Store:
+    """SQLite (WAL) store for citizens, facilities and vaccination events.
+
+    Safe to share between threads: each thread reads through its own
+    connection and writes are serialized by write_lock.
+    """
+
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self.write_lock = threading.Lock()
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self.write_lock:
+            self.connection.executescript(SCHEMA)
+
+    @property
+    def connection(self):
+        """This thread's connection, opened on first use."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _write(self, sql, rows=None, many=False):
+        with self.write_lock, self.connection as connection:
+            if many:
+                connection.executemany(sql, rows)
+            else:
+                connection.execute(sql, rows or ())
+
+    # reads
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM citizens').fetchone()[0]
+
+    def load_citizens(self):
+        """The citizen table with one 0/1 column per vaccine decoded from the status bitmask."""
+        citizens = pd.read_sql_query(f'SELECT {", ".join(CITIZEN_COLUMNS)}, Status FROM citizens ORDER BY rowid',
+                                     self.connection)
+        status = citizens.pop('Status').to_numpy(dtype=np.int64)
+        for vaccine, bit in vaccine_bits.items():
+            citizens[vaccine] = ((status & bit) != 0).astype(np.int64)
+        return citizens
+
+    def meta(self, key, default=None):
+        row = self.connection.execute('SELECT Value FROM meta WHERE Key = ?', (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def load_facilities(self):
+        return pd.read_sql_query('SELECT * FROM facilities ORDER BY rowid', self.connection)
+
+    def citizen(self, ID):
+        """One citizen's stored row as a dict (with Status), None if the ID is unknown."""
+        cursor = self.connection.execute('SELECT * FROM citizens WHERE ID = ?', (_value(ID),))
+        row = cursor.fetchone()
+        return None if row is None else dict(zip([column[0] for column in cursor.description], row))
+
+    def citizen_ids_at(self, hospital):
+        """IDs of the citizens assigned to a hospital (uses the Nearest_Hospital index)."""
+        rows = self.connection.execute('SELECT ID FROM citizens WHERE Nearest_Hospital = ?', (hospital,)).fetchall()
+        return [row[0] for row in rows]
+
+    def events(self, ID=None):
+        """Vaccination status changes, of one citizen or all of them, oldest first."""
+        if ID is None:
+            return pd.read_sql_query('SELECT * FROM vaccination_events ORDER BY Event', self.connection)
+        return pd.read_sql_query('SELECT * FROM vaccination_events WHERE ID = ? ORDER BY Event', self.connection,
+                                 params=(_value(ID),))
+
+    def doses_over_time(self, freq='D'):
+        """Cumulative net doses per vaccine at the end of each period (freq as in pandas, e.g. 'D', 'W', 'ME').
+
+        Counted in SQL from the vaccination events: a bit set by a change is a
+        dose, a bit cleared is a correction (-1).
+        """
+        columns = ', '.join(f'SUM(((New_Status & {bit}) != 0) - ((Old_Status & {bit}) != 0)) AS "{vaccine}"'
+                            for vaccine, bit in vaccine_bits.items())
+        # Recorded_At is an ISO timestamp in UTC, its first 10 characters are the day
+        daily = pd.read_sql_query(f'SELECT substr(Recorded_At, 1, 10) AS Date, {columns} FROM vaccination_events '
+                                  f'GROUP BY Date ORDER BY Date', self.connection)
+        if daily.empty:
+            return daily.set_index('Date')
+        daily.index = pd.to_datetime(daily.pop('Date'), utc=True)
+        return daily.resample(freq).sum().cumsum().astype(np.int64)
+
+    # writes
+    def save_facilities(self, hospitals):
+        rows = hospitals[FACILITY_COLUMNS].astype(object).itertuples(index=False, name=None)
+        self._write('INSERT OR REPLACE INTO facilities VALUES (?, ?, ?, ?, ?)',
+                    ([_value(value) for value in row] for row in rows), many=True)
+
+    def add_citizens(self, citizens, status=None):
+        """Insert citizens (IDs already stored are left as they are) with their status bitmasks."""
+        status = encode_status(citizens) if status is None else np.asarray(status)
+        table = citizens.reindex(columns=CITIZEN_COLUMNS).astype(object)
+        table['Status'] = status.astype(np.int64)
+        self._write(f'INSERT OR IGNORE INTO citizens ({", ".join(CITIZEN_COLUMNS)}, Status) '
+                    f'VALUES ({", ".join("?" * (len(CITIZEN_COLUMNS) + 1))})',
+                    ([_value(value) for value in row] for row in table.itertuples(index=False, name=None)), many=True)
+
+    def merge_citizens(self, citizens, status=None):
+        """Insert or update citizens from a newer register (e.g. a batch run).
+
+        Age, place and hospital assignment are replaced by the new values. The
+        status too, except for citizens with vaccination events: what was given
+        in the app is newer than the register, so their stored status is kept.
+        Citizens only in the store (registered in the app) are left as they are.
+        """
+        status = encode_status(citizens) if status is None else np.asarray(status)
+        table = citizens.reindex(columns=CITIZEN_COLUMNS).astype(object)
+        table['Status'] = status.astype(np.int64)
+        updates = ', '.join(f'{column} = excluded.{column}' for column in CITIZEN_COLUMNS[1:])
+        self._write(f'INSERT INTO citizens ({", ".join(CITIZEN_COLUMNS)}, Status) '
+                    f'VALUES ({", ".join("?" * (len(CITIZEN_COLUMNS) + 1))}) '
+                    f'ON CONFLICT (ID) DO UPDATE SET {updates}, '
+                    f'Status = CASE WHEN EXISTS (SELECT 1 FROM vaccination_events WHERE vaccination_events.ID = citizens.ID) '
+                    f'THEN citizens.Status ELSE excluded.Status END',
+                    ([_value(value) for value in row] for row in table.itertuples(index=False, name=None)), many=True)
+
+    def set_meta(self, key, value):
+        self._write('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, None if value is None else str(value)))
+
+    def add_citizen(self, record, status=0):
+        """Insert one citizen from a dict with the CITIZEN_COLUMNS."""
+        self._write(f'INSERT OR IGNORE INTO citizens ({", ".join(CITIZEN_COLUMNS)}, Status) '
+                    f'VALUES ({", ".join("?" * (len(CITIZEN_COLUMNS) + 1))})',
+                    [_value(record.get(column)) for column in CITIZEN_COLUMNS] + [int(status)])
+
+    def record_status(self, ID, old_status, new_status):
+        """Store a citizen's new status bitmask and log the change, in one transaction."""
+        ID, old_status, new_status = _value(ID), int(old_status), int(new_status)
+        with self.write_lock, self.connection as connection:
+            connection.execute('UPDATE citizens SET Status = ? WHERE ID = ?', (new_status, ID))
+            connection.execute('INSERT INTO vaccination_events (ID, Old_Status, New_Status, Recorded_At) '
+                               'VALUES (?, ?, ?, ?)',
+                               (ID, old_status, new_status, datetime.now(timezone.utc).isoformat()))
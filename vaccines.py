@@ -0,0 +1,87 @@
+# Vaccine catalogue for AngoVaxTracker
+#
+# Shared by the Streamlit app and the data pipeline modules.
+
+import numpy as np
+
+# Shortened list of vaccines
+vaccine_abbreviations = [
+    "BCG",  # Bacille Calmette-Guérin
+    "OPV",  # Oral Polio Vaccine
+    "IPV",  # Inactivated Polio Vaccine
+    "DTP",  # Diphtheria, Tetanus, Pertussis
+    "HepB",  # Hepatitis B
+    "MMR",  # Measles, Mumps, Rubella
+    "Rotavirus",
+    "PCV",  # Pneumococcal Conjugate Vaccine
+    "TT",  # Tetanus Toxoid
+    "YFV",  # Yellow Fever Vaccine
+]
+
+# Dictionary mapping abbreviations to full names
+vaccine_dictionary = {
+    "BCG": "Bacille Calmette-Guérin",
+    "OPV": "Oral Polio Vaccine",
+    "DTP": "Diphtheria, Tetanus, Pertussis",
+    "HepB": "Hepatitis B",
+    "MMR": "Measles, Mumps, Rubella",
+    "Rotavirus": "Rotavirus",
+    "PCV": "Pneumococcal Conjugate Vaccine",
+    "IPV": "Inactivated Polio Vaccine",
+    "YFV": "Yellow Fever Vaccine",
+    "TT": "Tetanus Toxoid",
+}
+
+# recommended year range for each vaccine
+vaccine_age_recommendations_years_int = {
+    "BCG": (0, 35),
+    "OPV": (0, 6),
+    "DTP": (0, 2),
+    "HepB": (0, 2),
+    "MMR": (1, 2),
+    "Rotavirus": (0, 1),
+    "PCV": (0, 2),
+    "IPV": (0, 2),
+    "YFV": (1, 10),
+    "TT": (0, 6),
+}
+
+# bit of each vaccine in the per-citizen vaccination status bitmask (uint16, one per citizen)
+vaccine_bits = {vaccine: 1 << i for i, vaccine in enumerate(vaccine_abbreviations)}
+all_vaccines_mask = sum(vaccine_bits.values())
+
+# the Patient class uses upper case names (HEPB, ROTAVIRUS), accept both spellings
+_bits_by_name = {**vaccine_bits, **{vaccine.upper(): bit for vaccine, bit in vaccine_bits.items()}}
+
+
+def status_bits(vaccines):
+    """Bitmask of one vaccine name or a list of them."""
+    if isinstance(vaccines, str):
+        vaccines = [vaccines]
+    try:
+        return sum(_bits_by_name[vaccine] for vaccine in set(vaccines))
+    except KeyError as error:
+        raise ValueError(f"Unknown vaccine: {error.args[0]}") from None
+
+
+def encode_status(citizens):
+    """uint16 bitmask per citizen from the 0/1 vaccine columns (missing columns or values count as 0)."""
+    status = np.zeros(len(citizens), dtype=np.uint16)
+    for vaccine, bit in vaccine_bits.items():
+        if vaccine in citizens:
+            status[citizens[vaccine].to_numpy(dtype=np.float64, na_value=np.nan) == 1] |= bit
+    return status
+
+
+def eligibility_status(ages, age_ranges=vaccine_age_recommendations_years_int):
+    """uint16 bitmask per citizen of the vaccines their age is in the recommended range for."""
+    ages = np.asarray(ages, dtype=np.float64)
+    eligible = np.zeros(len(ages), dtype=np.uint16)
+    for vaccine, (low, high) in age_ranges.items():
+        eligible[(ages >= low) & (ages <= high)] |= vaccine_bits[vaccine]
+    return eligible
+
+
+def decode_status(mask):
+    """Vaccines set in one citizen's bitmask, in catalogue order."""
+    return [vaccine for vaccine, bit in vaccine_bits.items() if mask & bit]